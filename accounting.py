@@ -0,0 +1,72 @@
+"""Time accounting for sessions, in whole seconds.
+
+Balances are stored in minutes (Kid.current_minutes and Kid.daily_bonus_used),
+but every calculation happens here on integer seconds, so starting, stopping
+and expiring a session all round the same way.
+
+Run `python test_accounting.py` to check deduct() against the old float-based
+code on random balances.
+"""
+from typing import List, Sequence, Tuple
+
+DAILY_BONUS_SECONDS = 15 * 60  # Bonus time every kid gets per day
+MIN_BALANCE_SECONDS = -5 * 60  # Main time can go this far into debt
+
+
+def to_seconds(minutes: float) -> int:
+    return int(round(minutes * 60))
+
+
+def to_minutes(seconds: int) -> float:
+    """Minutes for storage; two decimals are enough for to_seconds() to get the exact seconds back"""
+    return round(seconds / 60, 2)
+
+
+def display_minutes(minutes: float):
+    """Minutes for JSON: whole minutes stay integers (30, not 30.0) as before balances were kept to the second"""
+    return int(minutes) if float(minutes).is_integer() else minutes
+
+
+def bonus_left_seconds(bonus_used_seconds: int, bonus_enabled: bool) -> int:
+    if not bonus_enabled:
+        return 0
+    return max(0, DAILY_BONUS_SECONDS - bonus_used_seconds)
+
+
+def available_seconds(main_seconds: int, bonus_used_seconds: int, bonus_enabled: bool) -> int:
+    """How long a session can run: the positive main time plus what's left of today's bonus"""
+    return max(0, main_seconds) + bonus_left_seconds(bonus_used_seconds, bonus_enabled)
+
+
+def deduct(main_seconds: int, bonus_used_seconds: int, elapsed_seconds: int, allowance_seconds: int,
+           bonus_enabled: bool) -> Tuple[int, int, int]:
+    """Charge a finished session to a kid's balance.
+
+    The elapsed time is capped at the session's allowance, then taken from main
+    time first and from today's bonus after that. Whatever is still left (the
+    balance shrank while the session ran) pushes main time into debt, down to
+    MIN_BALANCE_SECONDS.
+
+    Returns (main_seconds, bonus_used_seconds, deducted_seconds); the deducted
+    seconds are what the log entry records.
+    """
+    deducted = max(0, min(elapsed_seconds, allowance_seconds))
+    from_main = min(deducted, max(0, main_seconds))
+    from_bonus = min(deducted - from_main, bonus_left_seconds(bonus_used_seconds, bonus_enabled))
+    main_seconds -= from_main
+    debt = min(deducted - from_main - from_bonus, max(0, main_seconds - MIN_BALANCE_SECONDS))
+    return main_seconds - debt, bonus_used_seconds + from_bonus, deducted
+
+
+def deduct_batch(main_seconds: Sequence[int], bonus_used_seconds: Sequence[int], elapsed_seconds: Sequence[int],
+                 allowance_seconds: Sequence[int], bonus_enabled: Sequence[bool]) -> Tuple[List[int], List[int], List[int]]:
+    """deduct() over columns of equal length, one row per kid (e.g. all sessions settled after a restart).
+
+    Returns the columns (main_seconds, bonus_used_seconds, deducted_seconds).
+    """
+    rows = [deduct(*row) for row in zip(main_seconds, bonus_used_seconds, elapsed_seconds, allowance_seconds, bonus_enabled)]
+    if not rows:
+        return [], [], []
+    main, bonus_used, deducted = zip(*rows)
+    return list(main), list(bonus_used), list(deducted)
+
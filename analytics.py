@@ -0,0 +1,148 @@
+"""Usage analytics from per-kid, per-day totals.
+
+Every write that logs a time or points change also adds to that day's
+UsageDaily row (add_usage), so a report reads at most one row per kid and day
+instead of scanning LogEntry; weeks are summed from their seven days.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, case
+from sqlmodel import Session, func, insert, select, update
+
+import accounting
+from models import Kid, LogEntry, LogSummary, UsageDaily
+
+USAGE_FIELDS = ("usage_seconds", "bonus_seconds", "sessions", "time_added", "points_change")
+BUCKETS = ("day", "week")
+MAX_RANGE_DAYS = 3 * 366
+
+# Prebuilt increment of existing rows, run as one executemany
+_table = UsageDaily.__table__
+ADD_USAGE = (
+    update(_table)
+    .where(_table.c.kid_id == bindparam("b_kid_id"), _table.c.day == bindparam("b_day"))
+    .values({field: _table.c[field] + bindparam(f"b_{field}") for field in USAGE_FIELDS})
+)
+
+
+def usage_day(timestamp: Optional[datetime] = None) -> str:
+    """The local date a change counts for; timestamp is UTC like LogEntry.timestamp (default: now)"""
+    if timestamp is None:
+        return str(date.today())
+    return str(timestamp.replace(tzinfo=timezone.utc).astimezone().date())
+
+
+def add_usage(session: Session, changes: Iterable[dict]):
+    """Add changes to the daily totals inside the caller's transaction.
+
+    Each change is a dict with kid_id, optionally day (default: today) and any of USAGE_FIELDS.
+    """
+    totals: Dict[Tuple[int, str], dict] = {}
+    for change in changes:
+        total = totals.setdefault((change["kid_id"], change.get("day") or usage_day()), dict.fromkeys(USAGE_FIELDS, 0))
+        for field in USAGE_FIELDS:
+            total[field] += change.get(field, 0)
+    if not totals:
+        return
+
+    existing = {
+        tuple(row) for row in session.exec(
+            select(UsageDaily.kid_id, UsageDaily.day)
+            .where(UsageDaily.kid_id.in_({kid_id for kid_id, _ in totals}), UsageDaily.day.in_({day for _, day in totals}))
+        ).all()
+    }
+    new = [{"kid_id": kid_id, "day": day, **total} for (kid_id, day), total in totals.items() if (kid_id, day) not in existing]
+    if new:
+        session.exec(insert(UsageDaily), params=new)
+    if existing:
+        session.exec(ADD_USAGE, params=[
+            {"b_kid_id": kid_id, "b_day": day, **{f"b_{field}": value for field, value in total.items()}}
+            for (kid_id, day), total in totals.items() if (kid_id, day) in existing
+        ])
+
+
+def backfill_usage(session: Session) -> int:
+    """Build the daily totals from the log for databases created before they existed.
+
+    The log doesn't record which part of a session came from the bonus, and
+    archived days only keep their net time, so those count as 0 usage. Days are
+    UTC dates here. Returns the number of rows written (0 if there already were some).
+    """
+    if session.exec(select(UsageDaily.kid_id).limit(1)).first() is not None:
+        return 0
+
+    # Session deductions are the only entries that take time without touching points
+    is_session = (LogEntry.time_change < 0) & (LogEntry.points_change == 0)
+    day = func.date(LogEntry.timestamp)
+    rows = session.exec(
+        select(
+            LogEntry.kid_id, day,
+            func.sum(case((is_session, -LogEntry.time_change), else_=0)),
+            func.sum(case((is_session, 1), else_=0)),
+            func.sum(case((is_session, 0), else_=LogEntry.time_change)),
+            func.sum(LogEntry.points_change),
+        ).where(LogEntry.kid_id.in_(select(Kid.id)))  # Deleted kids keep their log entries, but get no analytics
+        .group_by(LogEntry.kid_id, day)
+    ).all()
+    changes = [
+        {"kid_id": kid_id, "day": str(day), "usage_seconds": accounting.to_seconds(usage), "sessions": sessions,
+         "time_added": round(time_added, 2), "points_change": points}
+        for kid_id, day, usage, sessions, time_added, points in rows
+    ]
+    changes += [
+        {"kid_id": summary.kid_id, "day": str(summary.timestamp.date()), "points_change": summary.points_change}
+        for summary in session.exec(select(LogSummary).where(LogSummary.kid_id.in_(select(Kid.id)))).all()
+    ]
+    add_usage(session, changes)
+    session.commit()
+    return len({(change["kid_id"], change["day"]) for change in changes})
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    return day - timedelta(days=day.weekday()) if bucket == "week" else day  # Weeks start on Monday
+
+
+def usage_report(session: Session, kid_id: Optional[int], since: date, until: date, bucket: str) -> dict:
+    """Usage per kid and day or week between since and until (inclusive), with empty buckets filled in"""
+    kids_query = select(Kid.id, Kid.name).order_by(Kid.id)
+    usage_query = select(UsageDaily).where(UsageDaily.day >= str(since), UsageDaily.day <= str(until))
+    if kid_id is not None:
+        kids_query = kids_query.where(Kid.id == kid_id)
+        usage_query = usage_query.where(UsageDaily.kid_id == kid_id)
+
+    starts = []
+    start = bucket_start(since, bucket)
+    while start <= until:
+        starts.append(start)
+        start += timedelta(days=7 if bucket == "week" else 1)
+    report = {
+        kid: {"kid_id": kid, "name": name, "buckets": {start: dict.fromkeys(USAGE_FIELDS, 0) for start in starts}}
+        for kid, name in session.exec(kids_query).all()
+    }
+    for row in session.exec(usage_query).all():
+        if row.kid_id not in report:
+            continue
+        total = report[row.kid_id]["buckets"][bucket_start(date.fromisoformat(row.day), bucket)]
+        for field in USAGE_FIELDS:
+            total[field] += getattr(row, field)
+
+    kids = []
+    for kid in report.values():
+        buckets = [
+            {
+                "start": str(start),
+                "usage_minutes": accounting.to_minutes(total["usage_seconds"]),
+                "bonus_minutes": accounting.to_minutes(total["bonus_seconds"]),
+                "sessions": total["sessions"],
+                "time_added": round(total["time_added"], 2),
+                "points_change": total["points_change"],
+            }
+            for start, total in kid["buckets"].items()
+        ]
+        totals = {
+            field: round(sum(bucket[field] for bucket in buckets), 2)
+            for field in ("usage_minutes", "bonus_minutes", "sessions", "time_added", "points_change")
+        }
+        kids.append({"kid_id": kid["kid_id"], "name": kid["name"], "buckets": buckets, "totals": totals})
+    return {"bucket": bucket, "since": str(since), "until": str(until), "kids": kids}
@@ -0,0 +1,87 @@
+"""Archiving of old activity log entries.
+
+LogEntry rows older than the horizon are written to a gzip JSONL file and
+replaced by one LogSummary row per kid and day, whose time and points totals
+are exactly the sums of the rows they replace. The leaderboard repair and
+/api/logs read the summaries together with the recent detail rows.
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlmodel import Session, delete, func, select
+
+from models import LogEntry, LogSummary
+
+# Off unless set: archiving deletes the detail rows from the database (they stay in the archive files)
+LOG_ARCHIVE_DAYS = int(os.getenv("LOG_ARCHIVE_DAYS", 0))
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "./archive")
+
+
+def archive_cutoff(days: int, today: Optional[date] = None) -> datetime:
+    """Start of the first day that is kept in detail; whole days are archived, so summaries never overlap detail rows"""
+    today = today or date.today()
+    return datetime.combine(today - timedelta(days=days), datetime.min.time())
+
+
+def summary_reason(entries: int) -> str:
+    return f"Archived: {entries} log entries"
+
+
+def archive_logs(session: Session, cutoff: datetime, archive_dir: str = LOG_ARCHIVE_DIR) -> dict:
+    """Move the log entries before cutoff into an archive file and per-day summaries.
+
+    The archive file is complete before the database transaction starts, so no
+    entry is ever lost; if the transaction fails, the next run archives the same
+    entries again into a new file.
+    """
+    last_id = session.exec(select(func.max(LogEntry.id)).where(LogEntry.timestamp < cutoff)).first()
+    if last_id is None:
+        return {"archived": 0, "summaries": 0, "file": None}
+
+    # Entries are only ever added with the current time, but bound by id as well to be exact
+    archived = (LogEntry.timestamp < cutoff) & (LogEntry.id <= last_id)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"logs-before-{cutoff:%Y%m%d}-{datetime.utcnow():%Y%m%d%H%M%S}.jsonl.gz")
+    totals: Dict[Tuple[int, datetime], list] = {}
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as archive:
+        # Stream the entries: the log may have millions of rows
+        for log in session.exec(select(LogEntry).where(archived).order_by(LogEntry.id).execution_options(yield_per=5000)):
+            archive.write(json.dumps({
+                "id": log.id,
+                "kid_id": log.kid_id,
+                "time_change": log.time_change,
+                "points_change": log.points_change,
+                "reason": log.reason,
+                "timestamp": log.timestamp.isoformat()
+            }) + "\n")
+            day = datetime.combine(log.timestamp.date(), datetime.min.time())
+            total = totals.setdefault((log.kid_id, day), [0, 0, 0])
+            total[0] += log.time_change
+            total[1] += log.points_change
+            total[2] += 1
+            count += 1
+            if count % 5000 == 0:
+                session.expunge_all()  # Keep the identity map from growing with the stream
+        archive.flush()
+        os.fsync(archive.fileno())
+
+    # Add to existing summaries of the same day (e.g. a run that failed half way before)
+    existing = {
+        (summary.kid_id, summary.timestamp): summary
+        for summary in session.exec(select(LogSummary).where(LogSummary.timestamp < cutoff)).all()
+    }
+    for (kid_id, day), (time_change, points_change, entries) in totals.items():
+        summary = existing.get((kid_id, day)) or LogSummary(kid_id=kid_id, timestamp=day)
+        summary.time_change = round(summary.time_change + time_change, 2)
+        summary.points_change += points_change
+        summary.entries += entries
+        summary.reason = summary_reason(summary.entries)
+        session.add(summary)
+    session.exec(delete(LogEntry).where(archived))
+    session.commit()
+    return {"archived": count, "summaries": len(totals), "file": path}
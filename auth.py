@@ -0,0 +1,167 @@
+"""Admin password hashing and the server-side store of admin sessions.
+
+The admin password is kept as a bcrypt hash. BCRYPT_ROUNDS sets the cost of
+new hashes (each extra round doubles it); existing hashes keep the cost they
+were made with. ADMIN_PASSWORD_HASH (from the environment or a .env file, make
+one with generate_hash.py) takes precedence over the hash in the database.
+Databases from before hashing hold the password in plain text, which is
+hashed on the next start (see upgrade_stored_password).
+
+bcrypt is slow on purpose, so checks run on a small executor of their own
+instead of the event loop or the threadpool that serves every other request.
+Logging in creates an entry in SessionStore and only its random id goes into
+the signed session cookie, so guarded requests are checked in memory, and
+sessions expire after ADMIN_SESSION_TTL_SECONDS of inactivity or when more
+than ADMIN_SESSION_MAX are open (the least recently used goes first).
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+ADMIN_PASSWORD_HASH = os.getenv("ADMIN_PASSWORD_HASH") or None
+ADMIN_SESSION_TTL_SECONDS = float(os.getenv("ADMIN_SESSION_TTL_SECONDS", 12 * 60 * 60))
+ADMIN_SESSION_MAX = int(os.getenv("ADMIN_SESSION_MAX", 100))
+PASSWORD_CHECK_WORKERS = int(os.getenv("PASSWORD_CHECK_WORKERS", 2))
+VERIFIED_CACHE_SIZE = 8  # Recent successful (password, hash) checks that skip bcrypt
+
+# Signs the session cookie. Without it the cookies (and the sessions, which only live in memory) end with the process
+SESSION_SECRET_KEY = os.getenv("SESSION_SECRET_KEY") or secrets.token_hex(32)
+
+DEFAULT_PASSWORD = "admin"
+
+# Shared secret the PC lockers send as X-Device-Token. Without it only lockers on the server itself are trusted
+DEVICE_TOKEN = os.getenv("DEVICE_TOKEN") or None
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+class PasswordChecker:
+    """Checks passwords against bcrypt hashes on its own threads, remembering recent successes.
+
+    A success is remembered by an HMAC of the password and hash under a per-process key,
+    so the plain password is never kept. Failures always pay the full bcrypt cost.
+    """
+
+    def __init__(self, workers: int = PASSWORD_CHECK_WORKERS, cache_size: int = VERIFIED_CACHE_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-check")
+        self.key = secrets.token_bytes(32)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.verified: "OrderedDict[bytes, None]" = OrderedDict()
+
+    def check(self, password: str, stored: str) -> bool:
+        """Blocking check; plain text stored passwords (not upgraded yet) are compared in constant time"""
+        if not is_hashed(stored):
+            return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        digest = hmac.new(self.key, stored.encode("utf-8") + b"\0" + password.encode("utf-8"), hashlib.sha256).digest()
+        with self.lock:
+            if digest in self.verified:
+                self.verified.move_to_end(digest)
+                return True
+        try:
+            matches = bcrypt.checkpw(password.encode("utf-8"), stored.encode("utf-8"))
+        except ValueError:  # Not a valid bcrypt hash
+            return False
+        if matches:
+            with self.lock:
+                self.verified[digest] = None
+                while len(self.verified) > self.cache_size:
+                    self.verified.popitem(last=False)
+        return matches
+
+    async def verify(self, password: str, stored: Optional[str]) -> bool:
+        if not stored:
+            return False
+        return await asyncio.wrap_future(self.executor.submit(self.check, password, stored))
+
+
+class SessionStore:
+    """Admin sessions by random id, with a sliding expiry and a cap on how many are kept"""
+
+    def __init__(self, ttl_seconds: float = ADMIN_SESSION_TTL_SECONDS, max_sessions: int = ADMIN_SESSION_MAX):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self.expires: "OrderedDict[str, float]" = OrderedDict()  # Least recently used first
+
+    def create(self) -> str:
+        session_id = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self.lock:
+            self.purge_expired(now)
+            self.expires[session_id] = now + self.ttl_seconds
+            while len(self.expires) > self.max_sessions:
+                self.expires.popitem(last=False)
+        return session_id
+
+    def validate(self, session_id: Optional[str]) -> bool:
+        """Whether the session is open, extending it if so"""
+        if not session_id:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            expires = self.expires.get(session_id)
+            if expires is None:
+                return False
+            if expires <= now:
+                del self.expires[session_id]
+                return False
+            self.expires[session_id] = now + self.ttl_seconds
+            self.expires.move_to_end(session_id)
+            return True
+
+    def revoke(self, session_id: Optional[str]):
+        with self.lock:
+            self.expires.pop(session_id, None)
+
+    def purge_expired(self, now: float):
+        # Entries are in order of last use, and so of expiry, so stop at the first live one
+        while self.expires:
+            session_id, expires = next(iter(self.expires.items()))
+            if expires > now:
+                break
+            del self.expires[session_id]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.expires)
+
+
+def device_authorized(token: Optional[str], client_host: Optional[str]) -> bool:
+    """Whether a device request may report usage: the right DEVICE_TOKEN, or a loopback client if none is set"""
+    if DEVICE_TOKEN:
+        return bool(token) and hmac.compare_digest(token.encode("utf-8"), DEVICE_TOKEN.encode("utf-8"))
+    return client_host in LOOPBACK_HOSTS
+
+
+def stored_password(config_password: Optional[str]) -> Optional[str]:
+    """The hash to check logins against: ADMIN_PASSWORD_HASH if set, else the database's"""
+    return ADMIN_PASSWORD_HASH or config_password
+
+
+def upgrade_stored_password(admin_config) -> bool:
+    """Hash a plain text password left by an older version in place; True if the caller should commit"""
+    if admin_config.admin_password and not is_hashed(admin_config.admin_password):
+        admin_config.admin_password = hash_password(admin_config.admin_password)
+        return True
+    return False
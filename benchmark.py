@@ -0,0 +1,678 @@
+"""Benchmarks for the FamilyTime server.
+
+Every scenario runs against a fresh SQLite database in a temporary directory,
+so the real familiytime.db is never touched.
+
+Usage:
+    python benchmark.py leaderboard --log-rows 1000000
+    python benchmark.py status --iterations 5000
+    python benchmark.py sessions --sessions 500
+    python benchmark.py concurrency --threads 16 --seconds 10
+    python benchmark.py latency --threads 64 --seconds 10 --log-rows 100000
+    python benchmark.py devices --devices 50 --seconds 10
+    python benchmark.py bulk --adjustments 10000
+    python benchmark.py export --log-rows 1000000 --rss-budget-mb 50
+    python benchmark.py suite --log-rows 100000 --seconds 30 --output results.json --compare previous.json
+
+The suite scenario is the one to track over time: it runs kids.html tabs,
+ESP32 displays, PC lockers and admin write bursts against one server and
+saves throughput, p50/p95/p99 per endpoint and database queries per request
+as JSON (by default under benchmark-results/).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+def load_app(db_path):
+    """Import main.py against the given database file"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("LOG_ARCHIVE_DAYS", "0")  # The seeded year of logs must stay in detail
+    os.environ.setdefault("LOCK_BACKEND", "none")  # Expiring sessions must not lock this machine
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    return main
+
+
+def seed_database(db_path, kids, log_rows):
+    """Insert kids and random log rows directly with sqlite3 (much faster than the ORM)"""
+    today = str(datetime.utcnow().date())
+    start = datetime.utcnow() - timedelta(days=365)
+    connection = sqlite3.connect(db_path)
+    connection.executemany(
+        "INSERT INTO kid (id, name, current_minutes, daily_bonus_used, last_reset_date) VALUES (?, ?, ?, ?, ?)",
+        [(kid_id, f"Kid{kid_id}", 30, 0, today) for kid_id in range(1, kids + 1)],
+    )
+    rng = random.Random(42)
+    batch = []
+    for i in range(log_rows):
+        change = rng.randint(-10, 10)
+        timestamp = start + timedelta(seconds=i * 30)
+        # Same text format SQLAlchemy uses for DateTime columns on SQLite
+        batch.append((rng.randint(1, kids), change, change, "Benchmark entry", timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")))
+        if len(batch) >= 50000:
+            connection.executemany(
+                "INSERT INTO logentry (kid_id, time_change, points_change, reason, timestamp) VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+            batch = []
+    if batch:
+        connection.executemany(
+            "INSERT INTO logentry (kid_id, time_change, points_change, reason, timestamp) VALUES (?, ?, ?, ?, ?)",
+            batch,
+        )
+    connection.commit()
+    connection.close()
+
+
+def time_calls(func, iterations):
+    """Call func repeatedly and return the mean time per call in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def bench_leaderboard(args, db_path):
+    main = load_app(db_path)
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session, select
+
+    print(f"Seeding {args.kids} kids and {args.log_rows} log rows...")
+    seed_database(db_path, args.kids, args.log_rows)
+
+    def legacy_leaderboard():
+        # The old read_root: load every LogEntry and sum points in Python
+        with Session(main.engine) as session:
+            kid_points = {}
+            for log in session.exec(select(main.LogEntry)).all():
+                kid_points[log.kid_id] = kid_points.get(log.kid_id, 0) + log.points_change
+            return kid_points
+
+    with TestClient(main.app) as client:  # startup builds the KidPoints totals
+        start = time.perf_counter()
+        with Session(main.engine) as session:
+            main.repair_points(session)
+        repair_ms = (time.perf_counter() - start) * 1000
+
+        render_ms = time_calls(lambda: client.get("/"), args.iterations)
+        legacy_ms = time_calls(legacy_leaderboard, max(1, args.iterations // 10))
+
+    print(f"GET / (KidPoints aggregate):      {render_ms:10.2f} ms")
+    print(f"Legacy full LogEntry scan:        {legacy_ms:10.2f} ms")
+    print(f"recalculate_points GROUP BY job:  {repair_ms:10.2f} ms")
+
+
+def requests_per_second(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.perf_counter() - start)
+
+
+def bench_status(args, db_path):
+    main = load_app(db_path)
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        client.post("/admin/login", data={"password": "admin"})
+        client.post("/admin/start_session_with_time", data={"kid_id": 1, "session_time": 30})
+        for path in ("/api/session/status", "/api/active-session"):
+            assert client.get(path).json()["is_active"]
+            rate = requests_per_second(lambda: client.get(path), args.iterations)
+            print(f"GET {path:<22} {rate:10.0f} requests/sec")
+
+        # Conditional polls: unchanged data comes back as an empty 304
+        for path in ("/api/kids", "/api/logs", "/api/active-session"):
+            response = client.get(path)
+            etag = response.headers["ETag"]
+            assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+            full = requests_per_second(lambda: client.get(path), args.iterations)
+            conditional = requests_per_second(lambda: client.get(path, headers={"If-None-Match": etag}), args.iterations)
+            print(f"GET {path:<22} 200: {full:7.0f} requests/sec ({len(response.content)} bytes)   304: {conditional:7.0f} requests/sec (0 bytes)")
+
+
+def bench_sessions(args, db_path):
+    main = load_app(db_path)
+    from fastapi.testclient import TestClient
+    from sessions import SessionRegistry, SessionSnapshot
+
+    # Registry alone: start/lookup/stop of many concurrent sessions
+    registry = SessionRegistry()
+    snapshots = [SessionSnapshot(kid_id, f"Kid{kid_id}", 3600, 60, True, device=f"pc-{kid_id}") for kid_id in range(args.sessions)]
+    start = time.perf_counter()
+    for snapshot in snapshots:
+        registry.add(snapshot)
+    add_rate = len(snapshots) / (time.perf_counter() - start)
+    lookup_rate = requests_per_second(lambda: registry.for_device(f"pc-{args.sessions // 2}").remaining_seconds(), args.iterations * 10)
+    start = time.perf_counter()
+    for snapshot in snapshots:
+        registry.remove(snapshot)
+    remove_rate = len(snapshots) / (time.perf_counter() - start)
+    print(f"Registry with {args.sessions} sessions: add {add_rate:,.0f}/s, lookup {lookup_rate:,.0f}/s, remove {remove_rate:,.0f}/s")
+
+    # Through the HTTP endpoints, one kid per device
+    seed_database(db_path, args.sessions, 0)
+    with TestClient(main.app) as client:
+        client.post("/admin/login", data={"password": "admin"})
+        kid_ids = range(1, args.sessions + 1)
+
+        start = time.perf_counter()
+        for kid_id in kid_ids:
+            client.post("/admin/start_session_with_time", data={"kid_id": kid_id, "session_time": 30, "device": f"pc-{kid_id}"})
+        start_rate = args.sessions / (time.perf_counter() - start)
+        assert len(main.app.state.sessions) == args.sessions
+
+        status_rate = requests_per_second(
+            lambda: client.get("/api/session/status", params={"device": f"pc-{args.sessions // 2}"}), args.iterations
+        )
+
+        start = time.perf_counter()
+        for kid_id in kid_ids:
+            client.post("/admin/stop_session", data={"device": f"pc-{kid_id}"})
+        stop_rate = args.sessions / (time.perf_counter() - start)
+        assert len(main.app.state.sessions) == 0
+
+    print(f"HTTP with {args.sessions} sessions: start {start_rate:,.0f}/s, status {status_rate:,.0f}/s, stop {stop_rate:,.0f}/s")
+
+
+@contextmanager
+def serve(db_path, env=None):
+    """Run the app under uvicorn in a subprocess against db_path and yield its base URL"""
+    with serve_process(db_path, env) as (base_url, _):
+        yield base_url
+
+
+@contextmanager
+def serve_process(db_path, env=None):
+    """Like serve(), but yield (base URL, server process)"""
+    import requests
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process_env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", LOG_ARCHIVE_DAYS="0", LOCK_BACKEND="none", **(env or {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=process_env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                requests.get(f"{base_url}/api/kids", timeout=1)
+                break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.1)
+        yield base_url, process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_concurrency(args, db_path):
+    """Admin writes, ESP32/locker polls and kids page loads at the same time, with and without the SQLite tuning"""
+    import requests
+
+    configs = {
+        # What main.py did before storage.py: rollback journal, full fsync, no mmap
+        "untuned": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_MMAP_SIZE": "0"},
+        "tuned": {},
+    }
+    for name, env in configs.items():
+        path = f"{db_path}.{name}"
+        with serve(path, env) as base_url:
+            counts = {"ok": 0, "errors": 0}
+            lock = threading.Lock()
+            deadline = time.perf_counter() + args.seconds
+
+            def worker(number):
+                client = requests.Session()
+                client.post(f"{base_url}/admin/login", data={"password": "admin"})
+                rng = random.Random(number)
+                while time.perf_counter() < deadline:
+                    roll = rng.random()
+                    if roll < 0.3:
+                        response = client.post(f"{base_url}/admin/time", data={"kid_id": 1, "minutes": rng.choice([-1, 1]), "reason": "Stress"})
+                    elif roll < 0.4:
+                        response = client.post(f"{base_url}/admin/points", data={"kid_id": 1, "points": 1, "reason": "Stress"})
+                    elif roll < 0.8:
+                        response = client.get(f"{base_url}/api/kids")
+                    else:
+                        response = client.get(f"{base_url}/")
+                    with lock:
+                        counts["ok" if response.status_code < 500 else "errors"] += 1
+
+            threads = [threading.Thread(target=worker, args=(number,)) for number in range(args.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        total = counts["ok"] + counts["errors"]
+        print(f"{name:<8} {args.threads} threads: {total / args.seconds:8.0f} requests/sec, {counts['errors']} errors")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_latency(args, db_path):
+    """p50/p99 latency of the hot read endpoints under concurrent load, threadpool vs DB_ASYNC mode"""
+    import requests
+
+    load_app(db_path)  # Creates the schema, the servers below share this database
+    seed_database(db_path, args.kids, args.log_rows)
+    paths = ["/api/kids", "/api/logs", "/api/active-session", "/api/session/status"]
+
+    for mode, env in (("threadpool", {"DB_ASYNC": "0"}), ("async", {"DB_ASYNC": "1"})):
+        with serve(db_path, env) as base_url:
+            latencies = {path: [] for path in paths}
+            deadline = time.perf_counter() + args.seconds
+
+            def worker(number):
+                client = requests.Session()
+                client.post(f"{base_url}/admin/login", data={"password": "admin"})
+                rng = random.Random(number)
+                while time.perf_counter() < deadline:
+                    path = rng.choice(paths)
+                    start = time.perf_counter()
+                    response = client.get(f"{base_url}{path}")
+                    elapsed = (time.perf_counter() - start) * 1000
+                    assert response.status_code == 200, response.text
+                    latencies[path].append(elapsed)  # list.append is atomic
+
+            threads = [threading.Thread(target=worker, args=(number,)) for number in range(args.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for path in paths:
+            values = latencies[path]
+            print(f"{mode:<10} GET {path:<22} p50 {percentile(values, 0.5):7.2f} ms   p99 {percentile(values, 0.99):7.2f} ms   ({len(values)} requests)")
+
+
+def bench_devices(args, db_path):
+    """Many ESP32-style displays polling at once: JSON /api/active-session vs the text line of /api/device"""
+    import requests
+
+    load_app(db_path)  # Creates the schema
+    seed_database(db_path, args.devices, 0)
+
+    with serve(db_path) as base_url:
+        admin = requests.Session()
+        admin.post(f"{base_url}/admin/login", data={"password": "admin"})
+        # Every other device shows a running session
+        for number in range(1, args.devices + 1, 2):
+            admin.post(f"{base_url}/admin/start_session_with_time", data={"kid_id": number, "session_time": 30, "device": f"esp-{number}"})
+        session_deadline = time.time() + 30 * 60
+
+        def poll_json(client, number, state):
+            response = client.get(f"{base_url}/api/active-session", params={"device": f"esp-{number}"})
+            data = response.json()
+            assert data["is_active"] == (number % 2 == 1)
+            return len(response.content)
+
+        def poll_line(client, number, state):
+            headers = {"If-None-Match": state["etag"]} if state.get("etag") else {}
+            response = client.get(f"{base_url}/api/device/esp-{number}", headers=headers)
+            if response.status_code == 304:
+                return 0
+            state["etag"] = response.headers["ETag"]
+            # What the sketch does: parse the fixed fields, then count down from deadline - server time
+            active, server_now, deadline, kid_id, name = response.text.rstrip("\n").split(" ", 4)
+            assert active == str(number % 2)
+            if active == "1":
+                assert kid_id == str(number) and name == f"Kid{number}"
+                assert abs(int(deadline) - session_deadline) <= 2, "deadline drifted"
+            return len(response.content)
+
+        for name, poll in (("JSON /api/active-session", poll_json), ("text /api/device + ETag", poll_line)):
+            counts = {"requests": 0, "bytes": 0}
+            lock = threading.Lock()
+            deadline = time.perf_counter() + args.seconds
+
+            def device(number):
+                client = requests.Session()
+                state = {}
+                while time.perf_counter() < deadline:
+                    size = poll(client, number, state)
+                    with lock:
+                        counts["requests"] += 1
+                        counts["bytes"] += size
+
+            threads = [threading.Thread(target=device, args=(number,)) for number in range(1, args.devices + 1)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            print(f"{args.devices} devices, {name:<26} {counts['requests'] / args.seconds:8.0f} polls/sec, "
+                  f"{counts['bytes'] / max(1, counts['requests']):6.1f} body bytes/poll")
+
+
+def bench_bulk(args, db_path):
+    """10k time/points adjustments: one /admin/bulk_adjust call vs one /admin/time post each"""
+    main = load_app(db_path)
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session
+
+    seed_database(db_path, args.kids, 0)
+    rng = random.Random(17)
+    adjustments = [
+        {"kid_id": rng.randint(1, args.kids), "kind": rng.choice(["time", "points"]), "amount": rng.randint(-5, 10), "reason": "Benchmark"}
+        for _ in range(args.adjustments)
+    ]
+
+    with TestClient(main.app) as client:
+        client.post("/admin/login", data={"password": "admin"})
+
+        start = time.perf_counter()
+        response = client.post("/admin/bulk_adjust", json=adjustments)
+        bulk_seconds = time.perf_counter() - start
+        assert response.json()["applied"] == args.adjustments
+
+        # The form endpoints, one commit each; a sample is enough to extrapolate
+        sample = adjustments[: max(1, args.adjustments // 10)]
+        start = time.perf_counter()
+        for adjustment in sample:
+            path = "/admin/time" if adjustment["kind"] == "time" else "/admin/points"
+            field = "minutes" if adjustment["kind"] == "time" else "points"
+            client.post(path, data={"kid_id": adjustment["kid_id"], field: adjustment["amount"], "reason": "Benchmark"}, follow_redirects=False)
+        single_seconds = (time.perf_counter() - start) * args.adjustments / len(sample)
+
+        with Session(main.engine) as session:
+            _, repaired = main.repair_points(session)
+        assert not repaired, "KidPoints drifted from the log"
+
+    print(f"{args.adjustments} adjustments, bulk endpoint:   {bulk_seconds * 1000:10.0f} ms")
+    print(f"{args.adjustments} adjustments, single posts:    {single_seconds * 1000:10.0f} ms (extrapolated from {len(sample)})")
+
+
+def memory_mb(pid, field):
+    """VmRSS (current) or VmHWM (peak) of a process in MB, from /proc (Linux only)"""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"No {field} for process {pid}")
+
+
+def bench_export(args, db_path):
+    """Stream the whole log through /admin/export_logs and check the server's memory stays within --rss-budget-mb"""
+    import requests
+
+    load_app(db_path)
+    seed_database(db_path, args.kids, args.log_rows)
+    with serve_process(db_path) as (base_url, process):
+        client = requests.Session()
+        client.post(f"{base_url}/admin/login", data={"password": "admin"})
+        client.get(f"{base_url}/api/kids")  # Warm up
+        for export_format in ("csv", "jsonl"):
+            before = memory_mb(process.pid, "VmRSS")
+            start = time.perf_counter()
+            lines = size = 0
+            with client.get(f"{base_url}/admin/export_logs", params={"format": export_format}, stream=True) as response:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    lines += chunk.count(b"\n")
+                    size += len(chunk)
+            seconds = time.perf_counter() - start
+            growth = memory_mb(process.pid, "VmHWM") - before
+            rows = lines - (1 if export_format == "csv" else 0)
+            print(f"{export_format:<5} {rows:,} rows, {size / 1e6:7.1f} MB in {seconds:5.1f} s, server RSS +{growth:.1f} MB")
+            assert rows == args.log_rows, f"Exported {rows} of {args.log_rows} rows"
+            assert growth <= args.rss_budget_mb, f"Server RSS grew by {growth:.1f} MB, budget {args.rss_budget_mb} MB"
+
+
+# Requests measured for database queries per request, in-process: (label, method, path, params or form data).
+# A request listed in QUERY_COUNT_SETUP gets that POST (not counted) before each iteration.
+QUERY_COUNT_REQUESTS = [
+    ("GET /", "GET", "/", None),
+    ("GET /api/kids", "GET", "/api/kids", None),
+    ("GET /api/kids/delta", "GET", "/api/kids/delta", None),
+    ("GET /api/logs", "GET", "/api/logs", None),
+    ("GET /api/analytics", "GET", "/api/analytics", None),
+    ("GET /api/session/status", "GET", "/api/session/status", {"device": "esp-1"}),
+    ("GET /api/active-session", "GET", "/api/active-session", {"device": "esp-1"}),
+    ("GET /api/device/{device}", "GET", "/api/device/esp-1", None),
+    ("POST /admin/time", "POST", "/admin/time", {"kid_id": 1, "minutes": 1, "reason": "Benchmark"}),
+    ("POST /admin/points", "POST", "/admin/points", {"kid_id": 1, "points": 1, "reason": "Benchmark"}),
+    ("POST /admin/start_session_with_time", "POST", "/admin/start_session_with_time", {"kid_id": 1, "session_time": 30, "device": "esp-1"}),
+    ("POST /admin/stop_session", "POST", "/admin/stop_session", {"device": "esp-1"}),
+]
+QUERY_COUNT_SETUP = {
+    # Otherwise only the first stop finds a session to settle
+    "POST /admin/stop_session": ("/admin/start_session_with_time", {"kid_id": 1, "session_time": 30, "device": "esp-1"}),
+}
+
+
+def count_queries(main, iterations):
+    """Database queries per request for QUERY_COUNT_REQUESTS, counted with an engine event"""
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    counter = {"queries": 0}
+
+    def count(*_):
+        counter["queries"] += 1
+
+    event.listen(main.engine, "before_cursor_execute", count)
+    try:
+        with TestClient(main.app) as client:
+            client.post("/admin/login", data={"password": "admin"})
+            counts = {}
+            for label, method, path, data in QUERY_COUNT_REQUESTS:
+                total = 0
+                for _ in range(iterations):
+                    if label in QUERY_COUNT_SETUP:
+                        setup_path, setup_data = QUERY_COUNT_SETUP[label]
+                        client.post(setup_path, data=setup_data)
+                    before = counter["queries"]
+                    if method == "GET":
+                        response = client.get(path, params=data)
+                    else:
+                        response = client.post(path, data=data, follow_redirects=False)
+                    assert response.status_code < 400, (label, response.status_code, response.text)
+                    total += counter["queries"] - before
+                counts[label] = total / iterations
+            # Leave no session running for the load phase
+            client.post("/admin/stop_session", data={"device": "esp-1"})
+    finally:
+        event.remove(main.engine, "before_cursor_execute", count)
+    return counts
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args, db_path):
+    """Mixed load on one server: kids.html tabs, ESP32 displays, PC lockers and admin write bursts.
+
+    Prints and saves (JSON) throughput, p50/p95/p99 per endpoint and database queries per request.
+    """
+    import requests
+
+    started = datetime.utcnow()
+    main = load_app(db_path)
+    kids = max(args.kids, args.devices, args.lockers)  # One kid per display and per locker
+    print(f"Seeding {kids} kids and {args.log_rows} log rows...")
+    seed_database(db_path, kids, args.log_rows)
+    queries = count_queries(main, args.iterations)
+
+    latencies, statuses = {}, {}
+    lock = threading.Lock()
+
+    def timed(client, label, method, url, **kwargs):
+        start = time.perf_counter()
+        response = client.request(method, url, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.setdefault(label, []).append(elapsed)
+            counts = statuses.setdefault(label, {})
+            counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        return response
+
+    def conditional_get(client, etags, label, url, **kwargs):
+        headers = {"If-None-Match": etags[url]} if url in etags else {}
+        response = timed(client, label, "GET", url, headers=headers, **kwargs)
+        if response.status_code == 200:
+            etags[url] = response.headers.get("ETag")
+        return response
+
+    with serve(db_path) as base_url:
+        deadline = time.perf_counter() + args.seconds
+
+        def tab(number):
+            # kids.html: the page once, then conditional polls of the leaderboard rows and the session
+            client, etags = requests.Session(), {}
+            page = timed(client, "GET /", "GET", f"{base_url}/")
+            etags[f"{base_url}/api/kids/delta"] = page.headers.get("ETag")
+            while time.perf_counter() < deadline:
+                conditional_get(client, etags, "GET /api/kids/delta", f"{base_url}/api/kids/delta")
+                conditional_get(client, etags, "GET /api/active-session", f"{base_url}/api/active-session")
+
+        def display(number):
+            client, etags = requests.Session(), {}
+            while time.perf_counter() < deadline:
+                conditional_get(client, etags, "GET /api/device/{device}", f"{base_url}/api/device/esp-{number}")
+
+        def locker(number):
+            client, etags = requests.Session(), {}
+            while time.perf_counter() < deadline:
+                conditional_get(client, etags, "GET /api/session/status", f"{base_url}/api/session/status", params={"device": f"pc-{number}"})
+
+        def admin(number):
+            # Bursts of writes, a look at the log, and sessions started and stopped on the displays
+            client = requests.Session()
+            client.post(f"{base_url}/admin/login", data={"password": "admin"})
+            rng = random.Random(number)
+            while time.perf_counter() < deadline:
+                for _ in range(args.burst):
+                    kid_id = rng.randint(1, kids)
+                    if rng.random() < 0.5:
+                        timed(client, "POST /admin/time", "POST", f"{base_url}/admin/time",
+                              data={"kid_id": kid_id, "minutes": rng.choice([-1, 1]), "reason": "Benchmark"}, allow_redirects=False)
+                    else:
+                        timed(client, "POST /admin/points", "POST", f"{base_url}/admin/points",
+                              data={"kid_id": kid_id, "points": 1, "reason": "Benchmark"}, allow_redirects=False)
+                timed(client, "GET /api/logs", "GET", f"{base_url}/api/logs")
+                timed(client, "GET /", "GET", f"{base_url}/")
+                device = rng.randint(1, args.devices)
+                timed(client, "POST /admin/start_session_with_time", "POST", f"{base_url}/admin/start_session_with_time",
+                      data={"kid_id": device, "session_time": 30, "device": f"esp-{device}"})
+                timed(client, "POST /admin/stop_session", "POST", f"{base_url}/admin/stop_session", data={"device": f"esp-{device}"})
+
+        threads = [threading.Thread(target=tab, args=(number,)) for number in range(args.tabs)]
+        threads += [threading.Thread(target=display, args=(number,)) for number in range(1, args.devices + 1)]
+        threads += [threading.Thread(target=locker, args=(number,)) for number in range(1, args.lockers + 1)]
+        threads += [threading.Thread(target=admin, args=(number,)) for number in range(args.admins)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    endpoints = {}
+    for label in sorted(latencies):
+        values = latencies[label]
+        errors = sum(count for status, count in statuses[label].items() if status >= 500)
+        endpoints[label] = {
+            "requests": len(values),
+            "requests_per_second": round(len(values) / args.seconds, 1),
+            "p50_ms": round(percentile(values, 0.5), 2),
+            "p95_ms": round(percentile(values, 0.95), 2),
+            "p99_ms": round(percentile(values, 0.99), 2),
+            "not_modified": statuses[label].get(304, 0),
+            "errors": errors,
+            "queries_per_request": queries.get(label),
+        }
+    results = {
+        "scenario": "suite",
+        "started": started.isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+        "total_requests_per_second": round(sum(len(values) for values in latencies.values()) / args.seconds, 1),
+        "endpoints": endpoints,
+        "queries_per_request": queries,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)["endpoints"]
+    print(f"{'endpoint':<38} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'304':>7} {'errors':>6} {'queries':>7}")
+    for label, row in endpoints.items():
+        queries_text = "" if row["queries_per_request"] is None else f"{row['queries_per_request']:.1f}"
+        print(f"{label:<38} {row['requests_per_second']:8.1f} {row['p50_ms']:8.2f} {row['p95_ms']:8.2f} {row['p99_ms']:8.2f} "
+              f"{row['not_modified']:7} {row['errors']:6} {queries_text:>7}")
+        if previous and label in previous:
+            before = previous[label]
+            print(f"{'  vs ' + args.compare:<38} {row['requests_per_second'] - before['requests_per_second']:+8.1f} "
+                  f"{row['p50_ms'] - before['p50_ms']:+8.2f} {row['p95_ms'] - before['p95_ms']:+8.2f} {row['p99_ms'] - before['p99_ms']:+8.2f}")
+    print(f"Total {results['total_requests_per_second']:.0f} requests/sec")
+
+    output = args.output or os.path.join("benchmark-results", f"suite-{started:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved {output}")
+
+
+SCENARIOS = {
+    "leaderboard": bench_leaderboard,
+    "status": bench_status,
+    "sessions": bench_sessions,
+    "concurrency": bench_concurrency,
+    "latency": bench_latency,
+    "devices": bench_devices,
+    "bulk": bench_bulk,
+    "export": bench_export,
+    "suite": bench_suite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FamilyTime benchmarks")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--kids", type=int, default=5)
+    parser.add_argument("--log-rows", type=int, default=1000000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--adjustments", type=int, default=10000)
+    parser.add_argument("--rss-budget-mb", type=float, default=50)
+    parser.add_argument("--tabs", type=int, default=20, help="suite: kids.html tabs")
+    parser.add_argument("--lockers", type=int, default=10, help="suite: PC lockers")
+    parser.add_argument("--admins", type=int, default=2, help="suite: admins making write bursts")
+    parser.add_argument("--burst", type=int, default=5, help="suite: writes per admin burst")
+    parser.add_argument("--output", help="suite: JSON results file (default: benchmark-results/suite-<time>.json)")
+    parser.add_argument("--compare", help="suite: earlier JSON results to print the differences against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        SCENARIOS[args.scenario](args, os.path.join(tmp, "benchmark.db"))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,6 @@
 #include <SPI.h>
 #include <WiFi.h>
 #include <HTTPClient.h>
-#include <ArduinoJson.h>  // For JSON parsing
 
 // WiFi credentials - change these to your network
 const char* ssid = "Dershana";
@@ -43,13 +42,23 @@ bool wifiConnected = false;
 String activeKidName = "No active session";
 String timeRemaining = "";
 unsigned long lastKidsCheck = 0;
-const unsigned long kidsCheckInterval = 2000;  // Check for kids data every 2 seconds
+const unsigned long kidsCheckInterval = 2000;  // Check for session changes every 2 seconds
 unsigned long lastErrorDisplay = 0;
 const unsigned long errorDisplayInterval = 20000;        // Display error messages every 20 seconds
-String serverURL = "http://192.168.0.111:8000/api/active-session";  // API endpoint for active session data
+String serverBase = "http://192.168.0.111:8000";  // FamilyTime server
+String deviceId = "default";                      // Sessions started on this device are shown here
+String serverURL = serverBase + "/api/device/" + deviceId;  // One text line: state, server time, deadline, kid id, name
+
+// The countdown runs locally; the server is only polled to notice starts and stops
+bool sessionActive = false;
+unsigned long deadlineMillis = 0;  // millis() at which the session's time runs out
+bool expiryReported = false;
+String lastETag = "";              // Sent as If-None-Match, so unchanged polls are empty 304s
+unsigned long lastCountdownUpdate = 0;
 
 // Function to update for the next kid when time expires
 void updateForNextKid();
+bool updateCountdown();
 
 // Function to redraw all text elements on the screen
 void redrawAllText() {
@@ -101,64 +110,56 @@ String getActiveSessionData() {
   if (WiFi.status() == WL_CONNECTED) {
     HTTPClient http;
     http.begin(serverURL);
+    const char* headerKeys[] = {"ETag"};
+    http.collectHeaders(headerKeys, 1);
+    if (lastETag.length() > 0) {
+      http.addHeader("If-None-Match", lastETag);
+    }
 
     int httpResponseCode = http.GET();
 
-    if (httpResponseCode > 0) {
+    if (httpResponseCode == 304) {
+      // Nothing changed on the server, keep counting down
+      http.end();
+      return activeKidName;
+    }
+
+    if (httpResponseCode == 200) {
+      lastETag = http.header("ETag");
       String response = http.getString();
       http.end();
 
-      // Parse the JSON response
-      StaticJsonDocument<500> doc;
-      DeserializationError error = deserializeJson(doc, response);
-
-      if (error == DeserializationError::Ok) {
-        // Check if there's an active session
-        bool isActive = doc["is_active"];
-        if (isActive) {
-          // Get active kid information
-          String kidName = doc["active_kid"]["name"].as<String>();
-          double timeRemainingSeconds = doc["active_kid"]["time_remaining_seconds"];
-          
-          // Update the display variables
-          activeKidName = kidName;
-          
-          // Convert seconds to MM:SS format
-          int totalSeconds = (int)timeRemainingSeconds;
-          int minutes = abs(totalSeconds) / 60;
-          int seconds = abs(totalSeconds) % 60;
-          timeRemaining = String(minutes) + ":" + (seconds < 10 ? "0" : "") + String(seconds);
-          
-          // Add negative sign if time is negative (bonus time being used)
-          if (timeRemainingSeconds < 0) {
-            timeRemaining = "-" + timeRemaining;
-          }
-          
-          // Check if time has reached zero or gone negative
-          // Only trigger update if we just transitioned from positive to non-positive time
-          static bool wasPositiveTime = true;
-          if (wasPositiveTime && totalSeconds <= 0) {
-            wasPositiveTime = false;
-            // Time has expired, update for next kid
-            updateForNextKid();
-          } else if (totalSeconds > 0) {
-            wasPositiveTime = true;
-          }
+      // "<state> <server time> <deadline> <kid id> <name>", times in epoch seconds
+      int state = 0;
+      unsigned long serverNow = 0;
+      unsigned long deadline = 0;
+      int kidId = 0;
+      int nameStart = 0;
+      if (sscanf(response.c_str(), "%d %lu %lu %d %n", &state, &serverNow, &deadline, &kidId, &nameStart) >= 4) {
+        if (state == 1) {
+          activeKidName = response.substring(nameStart);
+          activeKidName.trim();
+          // Only the difference of the two server times matters, so the ESP32 needs no clock of its own
+          deadlineMillis = millis() + (deadline - serverNow) * 1000UL;
+          sessionActive = true;
+          expiryReported = false;
         } else {
           // No active session
+          sessionActive = false;
           activeKidName = "No active session";
           timeRemaining = "";
         }
 
+        updateCountdown();
         // Redraw all text elements on the screen
         redrawAllText();
 
         // Return the active kid name for compatibility
         return activeKidName;
       } else {
-        // Only show JSON parsing error every 20 seconds to reduce spam
+        // Only show parsing error every 20 seconds to reduce spam
         if (millis() - lastErrorDisplay >= errorDisplayInterval) {
-          Serial.println("JSON parsing failed!");
+          Serial.println("Parsing device status failed!");
           lastErrorDisplay = millis();
         }
         return "";
@@ -177,12 +178,37 @@ String getActiveSessionData() {
   return "";
 }
 
+// Work out the remaining MM:SS from the local deadline; returns true if the text changed
+bool updateCountdown() {
+  if (!sessionActive) {
+    return false;
+  }
+
+  long remainingMillis = (long)(deadlineMillis - millis());
+  int totalSeconds = remainingMillis > 0 ? (remainingMillis + 999) / 1000 : 0;
+  int minutes = totalSeconds / 60;
+  int seconds = totalSeconds % 60;
+  String newTime = String(minutes) + ":" + (seconds < 10 ? "0" : "") + String(seconds);
+
+  // Tell the server once when the time runs out (it also expires the session by itself)
+  if (totalSeconds <= 0 && !expiryReported) {
+    expiryReported = true;
+    updateForNextKid();
+  }
+
+  if (newTime == timeRemaining) {
+    return false;
+  }
+  timeRemaining = newTime;
+  return true;
+}
+
 // Function to update for the next kid when time expires
 void updateForNextKid() {
   if (WiFi.status() == WL_CONNECTED) {
     HTTPClient http;
     // Use the same server URL but with POST to indicate time expiration
-    String updateURL = serverURL + "/time-expired";  // This endpoint should handle time expiration on the server
+    String updateURL = serverBase + "/api/active-session/time-expired?device=" + deviceId;  // This endpoint should handle time expiration on the server
     http.begin(updateURL);
     http.addHeader("Content-Type", "application/json");
 
@@ -239,4 +265,12 @@ void loop() {
     String newActiveKid = getActiveSessionData();
     lastKidsCheck = millis();
   }
+
+  // Count down between polls, redrawing only when the shown time changes
+  if (millis() - lastCountdownUpdate >= 200) {
+    lastCountdownUpdate = millis();
+    if (updateCountdown()) {
+      redrawAllText();
+    }
+  }
 }
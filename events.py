@@ -0,0 +1,79 @@
+import asyncio
+import json
+import threading
+import uuid
+from typing import Optional, Set
+
+
+class StateVersion:
+    """A counter bumped on every change to kids, logs or sessions, used as the ETag of polled endpoints.
+
+    The counter lives in memory, so the ETag also carries a per-process id: after a
+    restart no client can get a 304 for a response from before it.
+    """
+
+    def __init__(self):
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def bump(self):
+        with self.lock:
+            self.value += 1
+
+    @property
+    def etag(self) -> str:
+        return f'W/"{self.boot_id}-{self.value}"'
+
+
+class EventBroker:
+    """Fan out session and balance events to every connected SSE/WebSocket client.
+
+    Sync endpoints run in Starlette's threadpool, so publish() hands each event
+    over to the event loop with call_soon_threadsafe. Every event is a change,
+    so publishing also bumps the state version.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.version = StateVersion()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event_type: str, data: dict):
+        """Send an event to all subscribers (safe to call from any thread)"""
+        self.version.bump()
+        if self.loop is None or self.loop.is_closed():
+            return  # Not serving yet, nobody can be listening
+        message = {"type": event_type, "data": data}
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self._dispatch(message)
+        else:
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+
+    def _dispatch(self, message: dict):
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Slow client: drop its oldest event, every event carries the full state anyway
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+def format_sse(event_type: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
@@ -1,13 +1,15 @@
-import bcrypt
+import getpass
+import sys
 
-def generate_hash(password):
-    """Generate bcrypt hash for a given password"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+from auth import BCRYPT_ROUNDS, hash_password
+
+def generate_hash(password, rounds=BCRYPT_ROUNDS):
+    """Generate bcrypt hash for a given password (BCRYPT_ROUNDS sets the cost)"""
+    return hash_password(password, rounds)
 
 if __name__ == "__main__":
-    # Generate a hash for the default password 'admin'
-    password = "admin"
+    # Usage: python generate_hash.py [password]; asks for the password if it isn't given
+    password = sys.argv[1] if len(sys.argv) > 1 else getpass.getpass("Admin password: ")
     hashed_password = generate_hash(password)
-    print(f"Generated hash for password '{password}': {hashed_password}")
\ No newline at end of file
+    # Put this line in .env (or the environment) to use it as the admin password
+    print(f"ADMIN_PASSWORD_HASH={hashed_password}")
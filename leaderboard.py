@@ -0,0 +1,87 @@
+"""The kids page leaderboard, cached per state version.
+
+Every write bumps the state version (see events.py), so anything computed for
+one version stays valid until the next write: the ranked rows and the rendered
+page are built once per version and then served from memory. A short history
+of rows lets /api/kids/delta tell a page which rows changed since the version
+it shows.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from sqlmodel import Session, func, select
+
+import accounting
+from models import Kid, KidPoints
+
+HISTORY_SIZE = 32  # Versions kept for deltas; older pages get a full update
+
+_points = func.coalesce(KidPoints.points, 0)
+LEADERBOARD = (
+    select(Kid.id, Kid.name, Kid.current_minutes, _points)
+    .outerjoin(KidPoints, KidPoints.kid_id == Kid.id)
+    .order_by(_points.desc(), Kid.id)
+)
+
+
+def leaderboard_rows(session: Session) -> List[dict]:
+    """Kids ranked by points (kept in KidPoints), then by id"""
+    return [
+        {"id": kid_id, "name": name, "current_minutes": accounting.display_minutes(minutes), "points": points}
+        for kid_id, name, minutes, points in session.exec(LEADERBOARD).all()
+    ]
+
+
+def diff_rows(old: Optional[List[dict]], new: List[dict]) -> dict:
+    """Ids of the rows that are new or changed and of the rows that are gone; everything when old is None"""
+    if old is None:
+        return {"full": True, "changed": [row["id"] for row in new], "removed": []}
+    old_rows = {row["id"]: row for row in old}
+    new_ids = {row["id"] for row in new}
+    return {
+        "full": False,
+        "changed": [row["id"] for row in new if old_rows.get(row["id"]) != row],
+        "removed": [kid_id for kid_id in old_rows if kid_id not in new_ids],
+    }
+
+
+class LeaderboardCache:
+    """Rows per version (the last HISTORY_SIZE versions) and the page of the latest one"""
+
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self.history_size = history_size
+        self.lock = threading.Lock()
+        self.rows: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self.page_version: Optional[str] = None
+        self.page: Optional[str] = None
+
+    def get_rows(self, version: str) -> Optional[List[dict]]:
+        with self.lock:
+            return self.rows.get(version)
+
+    def put_rows(self, version: str, rows: List[dict]):
+        with self.lock:
+            self.rows[version] = rows
+            while len(self.rows) > self.history_size:
+                self.rows.popitem(last=False)
+
+    def get_page(self, version: str) -> Optional[str]:
+        with self.lock:
+            return self.page if self.page_version == version else None
+
+    def put_page(self, version: str, page: str):
+        with self.lock:
+            self.page_version, self.page = version, page
+
+    def delta(self, since: Optional[str], version: str, rows: List[dict], render_row: Callable[[dict], str]) -> dict:
+        """What a page showing version `since` needs to show `version`: rendered rows, removed ids and the ranking"""
+        changes = diff_rows(self.get_rows(since) if since else None, rows)
+        by_id: Dict[int, dict] = {row["id"]: row for row in rows}
+        return {
+            "version": version,
+            "full": changes["full"],
+            "rows": {kid_id: render_row(by_id[kid_id]) for kid_id in changes["changed"]},
+            "removed": changes["removed"],
+            "order": [row["id"] for row in rows],
+        }
@@ -0,0 +1,107 @@
+"""Locking the screen of the machine the server runs on.
+
+Lock commands can take a while or hang (xdg-screensaver without a running
+screensaver), so ScreenLocker runs them on a background thread with a timeout.
+Requests only queue the lock; the outcome is kept for /api/lock/status.
+
+The backend is picked by platform.system(), or set with LOCK_BACKEND
+(e.g. "none" on a headless server).
+"""
+import os
+import platform
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+LOCK_BACKEND = os.getenv("LOCK_BACKEND", "auto")
+LOCK_TIMEOUT_SECONDS = float(os.getenv("LOCK_TIMEOUT_SECONDS", 5))
+
+# Backend name -> function(timeout) that locks the screen, raising on failure
+BACKENDS: Dict[str, Callable[[float], None]] = {}
+
+
+def register_backend(name: str):
+    def register(function: Callable[[float], None]):
+        BACKENDS[name] = function
+        return function
+    return register
+
+
+@register_backend("Windows")
+def lock_windows(timeout: float):
+    subprocess.run(["rundll32.exe", "user32.dll,LockWorkStation"], check=True, timeout=timeout, capture_output=True, text=True)
+
+
+@register_backend("Darwin")  # macOS
+def lock_macos(timeout: float):
+    subprocess.run(["pmset", "displaysleepnow"], check=True, timeout=timeout, capture_output=True, text=True)
+
+
+@register_backend("Linux")
+def lock_linux(timeout: float):
+    try:
+        subprocess.run(["xdg-screensaver", "lock"], check=True, timeout=timeout, capture_output=True, text=True)
+    except FileNotFoundError:
+        # No xdg-utils, e.g. a minimal systemd desktop
+        subprocess.run(["loginctl", "lock-session"], check=True, timeout=timeout, capture_output=True, text=True)
+
+
+@register_backend("none")
+def lock_nothing(timeout: float):
+    """For headless servers: there is no screen to lock"""
+
+
+class ScreenLocker:
+    """Runs lock requests one at a time on a background thread and remembers how they went"""
+
+    def __init__(self, backend: str = LOCK_BACKEND, timeout: float = LOCK_TIMEOUT_SECONDS):
+        self.backend = platform.system() if backend == "auto" else backend
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lock-screen")
+        self.lock = threading.Lock()
+        self.status = {
+            "backend": self.backend,
+            "pending": 0,
+            "last_requested": None,
+            "last_finished": None,
+            "last_ok": None,
+            "last_error": None,
+            "failures": 0,
+        }
+
+    def lock_screen(self) -> Future:
+        """Queue a screen lock and return at once"""
+        with self.lock:
+            self.status["pending"] += 1
+            self.status["last_requested"] = datetime.utcnow().isoformat()
+        return self.executor.submit(self._run)
+
+    def _run(self):
+        error = None
+        try:
+            backend = BACKENDS.get(self.backend)
+            if backend is None:
+                raise RuntimeError(f"No lock backend for {self.backend!r}, set LOCK_BACKEND")
+            backend(self.timeout)
+        except subprocess.TimeoutExpired:
+            error = f"Lock command timed out after {self.timeout} s"
+        except subprocess.CalledProcessError as e:
+            error = f"{e.cmd[0]} failed with exit status {e.returncode}: {(e.stderr or '').strip()}"
+        except Exception as e:
+            error = str(e)
+        if error:
+            print(f"Error locking screen: {error}")
+
+        with self.lock:
+            self.status["pending"] -= 1
+            self.status["last_finished"] = datetime.utcnow().isoformat()
+            self.status["last_ok"] = error is None
+            self.status["last_error"] = error
+            if error:
+                self.status["failures"] += 1
+
+    def get_status(self) -> Dict[str, Optional[object]]:
+        with self.lock:
+            return dict(self.status)
@@ -1,76 +1,517 @@
-from fastapi import FastAPI, Request, HTTPException, Form, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Request, HTTPException, Form, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
-from sqlmodel import SQLModel, create_engine, Session, select
-from models import Kid, LogEntry, AdminConfig
+from sqlmodel import SQLModel, Session, select, func, update, delete, insert, and_, or_
+from sqlalchemy import bindparam
+from models import Kid, LogEntry, LogSummary, AdminConfig, KidPoints, SessionEvent, UsageDaily, UsageEvent, Adjustment
+from events import EventBroker, format_sse
+from sessions import SessionSnapshot, SessionRegistry, DeadlineScheduler, DEFAULT_DEVICE, LOCAL_DEVICE
+import accounting
+from storage import engine, async_engine, get_kid, get_admin_config, run_query, admin_config_cache, AdminSettings
+from locking import ScreenLocker
+import archive
+import analytics
+import metrics
+import leaderboard
+import auth
 from contextlib import contextmanager
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+import csv
+import io
+import json
 import os
 import time
-from typing import Optional
+from typing import List, Optional
 import asyncio
 
-# Global variable to track the last time deduction was calculated for display purposes
-last_display_calc_time = datetime.utcnow()
-
 # Add session middleware
 app = FastAPI()
-app.add_middleware(SessionMiddleware, secret_key="your-super-secret-key-change-this-in-production")
+# The cookie only carries the id of a server-side admin session (see auth.py)
+app.add_middleware(SessionMiddleware, secret_key=auth.SESSION_SECRET_KEY)
 
-# Database setup
-DATABASE_URL = "sqlite:///./familiytime.db"
-engine = create_engine(DATABASE_URL, echo=False)
+# Database setup (engine and SQLite tuning live in storage.py)
 
 # Create tables
 def create_db_and_tables():
     SQLModel.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist, so add any that are missing
+    for index in LogEntry.__table__.indexes | LogSummary.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
 
 # Initialize database
 create_db_and_tables()
 
 # Templates
 templates = Jinja2Templates(directory="templates")
+leaderboard_cache = leaderboard.LeaderboardCache()
+
+# In-memory snapshots of the running sessions, one per kid and per device
+app.state.sessions = SessionRegistry()
+# Expires each session at its deadline even if no client is polling
+scheduler = DeadlineScheduler()
+
+# Pushes session and balance changes to kids.html, pc_locker.pyw etc. (see /api/events)
+broker = EventBroker()
 
-# In-memory storage for active kid and session tracking
-app.state.active_kid_id = None
-app.state.session_start_time = None  # When the session started
-app.state.time_remaining_at_start = 0  # Time remaining when session started
-app.state.original_time_at_session_start = 0  # Original time at session start for accurate deduction
+class StateVersionMiddleware:
+    """Bump the state version after every successful write request, so polled endpoints stop answering 304.
 
+    The bump happens when the response starts, i.e. after the endpoint committed and
+    before the client can see the response and poll again.
+    """
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_and_bump(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                broker.version.bump()
+            await send(message)
+        
+        await self.app(scope, receive, send_and_bump)
 
+app.add_middleware(StateVersionMiddleware)
+
+# Latency, query counts and database time per route, for /metrics (see metrics.py)
+request_metrics = metrics.Metrics()
+app.add_middleware(metrics.MetricsMiddleware, metrics=request_metrics)
+metrics.instrument_engine(engine)
+if async_engine is not None:
+    metrics.instrument_engine(async_engine.sync_engine)
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already has this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+async def conditional_response(request: Request, build, response_class=JSONResponse):
+    """304 if the client already has the current state version, otherwise build() (may be a coroutine) as the response body"""
+    # Read the ETag before building the body: a write in between then makes the next poll refetch
+    etag = broker.version.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = build()
+    if asyncio.iscoroutine(body):
+        body = await body
+    return response_class(body, headers=headers)
 
 def get_session():
     with Session(engine) as session:
         yield session
 
-def verify_password(plain_password: str, session: Session) -> bool:
-    # Get the admin config from the database
-    admin_config = session.get(AdminConfig, 1)  # Assuming single admin config record
-    if not admin_config:
-        return False  # No admin config exists
-    return admin_config.admin_password == plain_password
+password_checker = auth.PasswordChecker()
+admin_sessions = auth.SessionStore()
 
-def admin_required(request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
+def admin_password(session: Session) -> Optional[str]:
+    return auth.stored_password(admin_config_cache.get(session).admin_password)
+
+async def verify_password(plain_password: str) -> bool:
+    """Check the password against the stored hash, off the event loop"""
+    return await password_checker.verify(plain_password, await run_query(admin_password))
+
+def is_admin(request: Request) -> bool:
+    """Whether the request belongs to an open admin session, checked in memory"""
+    return admin_sessions.validate(request.session.get("admin_session"))
+
+def add_points(session: Session, kid_id: int, points: int):
+    """Apply a points change to the kid's leaderboard total inside the caller's transaction"""
+    if not points:
+        return
+    result = session.exec(
+        update(KidPoints)
+        .where(KidPoints.kid_id == kid_id)
+        .values(points=KidPoints.points + points)
+    )
+    if result.rowcount == 0:
+        session.add(KidPoints(kid_id=kid_id, points=points))
+
+def repair_points(session: Session):
+    """Verify the leaderboard totals against a GROUP BY over the log and fix any drift.
+
+    Returns the points per kid summed from the log and the ids of the kids that were repaired.
+    """
+    log_points = dict(session.exec(
+        select(LogEntry.kid_id, func.sum(LogEntry.points_change)).group_by(LogEntry.kid_id)
+    ).all())
+    # Archived entries count through their daily summaries
+    for kid_id, points in session.exec(
+        select(LogSummary.kid_id, func.sum(LogSummary.points_change)).group_by(LogSummary.kid_id)
+    ).all():
+        log_points[kid_id] = log_points.get(kid_id, 0) + points
+    stored = {row.kid_id: row for row in session.exec(select(KidPoints)).all()}
+    kid_ids = session.exec(select(Kid.id)).all()
+    
+    repaired = []
+    for kid_id in kid_ids:
+        expected = log_points.get(kid_id, 0)
+        row = stored.pop(kid_id, None)
+        if row is None:
+            session.add(KidPoints(kid_id=kid_id, points=expected))
+            repaired.append(kid_id)
+        elif row.points != expected:
+            row.points = expected
+            session.add(row)
+            repaired.append(kid_id)
+    
+    # Drop totals left behind by deleted kids
+    for row in stored.values():
+        session.delete(row)
+        repaired.append(row.kid_id)
+    
+    session.commit()
+    return log_points, repaired
+
+def publish_balance(session: Session, kid_id: int):
+    """Tell connected clients about a kid's new time balance and points (call after commit)"""
+    kid = get_kid(session, kid_id)
+    if not kid:
+        return
+    kid_points = session.get(KidPoints, kid_id)
+    broker.publish("balance_changed", {
+        "kid_id": kid_id,
+        "minutes": accounting.display_minutes(kid.current_minutes),
+        "points": kid_points.points if kid_points else 0
+    })
+
+def session_payload(snapshot: Optional[SessionSnapshot]):
+    """The /api/active-session payload for one session, computed from its in-memory snapshot"""
+    if not snapshot:
+        return {"is_active": False, "active_kid": None}
+    
+    return {
+        "is_active": True,
+        "session_id": snapshot.session_id,
+        "device": snapshot.device,
+        "active_kid": {
+            "id": snapshot.kid_id,
+            "name": snapshot.kid_name,
+            "time_remaining_seconds": snapshot.remaining_seconds()
+        }
+    }
+
+def session_ended_payload(snapshot: SessionSnapshot):
+    """Event payload telling clients which session just ended"""
+    return {
+        "is_active": False,
+        "active_kid": None,
+        "session_id": snapshot.session_id,
+        "device": snapshot.device,
+        "kid_id": snapshot.kid_id
+    }
+
+def journal_event(session: Session, event: str, snapshot: SessionSnapshot, offset_seconds: float = 0):
+    """Append a session event to the journal; committed together with the caller's changes"""
+    session.add(SessionEvent(
+        session_id=snapshot.session_id,
+        event=event,
+        kid_id=snapshot.kid_id,
+        device=snapshot.device,
+        duration_seconds=snapshot.duration_seconds,
+        original_minutes=snapshot.original_minutes,
+        bonus_time_enabled=snapshot.bonus_time_enabled,
+        offset_seconds=offset_seconds
+    ))
+
+def start_session_snapshot(session: Session, kid: Kid, duration_seconds: float, bonus_time_enabled: bool, device: str):
+    """Register the kid's session on the device; status polls are answered from this snapshot"""
+    snapshot = SessionSnapshot(
+        kid_id=kid.id,
+        kid_name=kid.name,
+        duration_seconds=duration_seconds,
+        original_minutes=kid.current_minutes,  # Record original time for accurate deduction
+        bonus_time_enabled=bonus_time_enabled,
+        device=device
+    )
+    # Journal the start first, so a restart can't lose the session
+    journal_event(session, "start", snapshot)
+    session.commit()
+    
+    # Normally end_sessions_in_the_way already made room; this only catches concurrent starts
+    for displaced in app.state.sessions.add(snapshot):
+        scheduler.cancel(displaced.session_id)
+        settle_session(displaced, displaced.elapsed_seconds(), "Session replaced by a new session", "stop")
+        broker.publish("session_stopped", session_ended_payload(displaced))
+    
+    activate_session(snapshot)
+    return snapshot
+
+def activate_session(snapshot: SessionSnapshot):
+    """Arm the deadline of a registered session and tell the clients about it"""
+    scheduler.schedule(snapshot.session_id, snapshot.deadline, expire_session, snapshot, retry=retry_expire_session)
+    broker.publish("session_started", session_payload(snapshot))
+
+def end_sessions_in_the_way(session: Session, kid: Kid, device: str):
+    """Settle the kid's running session and the one on the device before a new session starts"""
+    end_kid_session(session, kid)
+    end_device_session(device)
+
+def end_kid_session(session: Session, kid: Kid):
+    """Settle the kid's running session, so its balance is up to date for the new session's allowance"""
+    replace_session(app.state.sessions.for_kid(kid.id))
+    # The settlement may have changed the kid's balance
+    session.refresh(kid)
+    catch_up_daily_bonus(session, kid)
+
+def catch_up_daily_bonus(session: Session, kid: Kid):
+    """Reset the bonus now if the midnight timer hasn't yet.
+
+    The timer counts on the monotonic clock, which stops while the machine
+    sleeps, so after a suspend it can fire hours late.
+    """
+    if kid.last_reset_date == str(date.today()):
+        return
+    if rollover_daily_bonus():
+        broker.publish("kids_changed", {"kid_id": None})
+    session.refresh(kid)
+
+def end_device_session(device: str):
+    """Settle the session on the device; only once the new session is sure to start"""
+    replace_session(app.state.sessions.for_device(device))
+
+def replace_session(snapshot: Optional[SessionSnapshot]):
+    if snapshot and claim_session(snapshot):
+        settle_session(snapshot, snapshot.elapsed_seconds(), "Session replaced by a new session", "stop")
+        broker.publish("session_stopped", session_ended_payload(snapshot))
+
+def claim_session(snapshot: SessionSnapshot) -> bool:
+    """Atomically end a session, so a stop and an expiry can't both deduct it.
+
+    Returns False if the session had already ended.
+    """
+    if not app.state.sessions.remove(snapshot):
+        return False
+    scheduler.cancel(snapshot.session_id)
     return True
 
+def session_allowance(kid: Kid, bonus_time_enabled: bool) -> float:
+    """How many seconds a new session for the kid may run"""
+    return accounting.available_seconds(
+        accounting.to_seconds(kid.current_minutes), accounting.to_seconds(kid.daily_bonus_used), bonus_time_enabled
+    )
+
+def settle_session(snapshot: SessionSnapshot, elapsed_seconds: float, reason: str, event: str):
+    """Deduct a finished session's time from the kid, log it and close it in the journal"""
+    settle_sessions([(snapshot, elapsed_seconds)], reason, event)
+
+def settle_sessions(finished, reason: str, event: str):
+    """Settle a list of (snapshot, elapsed_seconds) in one transaction"""
+    with Session(engine) as session:
+        # The journal entries commit together with the deductions, so a replay never deducts twice
+        for snapshot, _ in finished:
+            journal_event(session, event, snapshot, offset_seconds=snapshot.elapsed_seconds())
+        
+        bonus_time_enabled = admin_config_cache.get(session).bonus_time_enabled
+        
+        kid_ids = {snapshot.kid_id for snapshot, _ in finished}
+        kids = {kid.id: kid for kid in session.exec(select(Kid).where(Kid.id.in_(kid_ids))).all()}
+        rows = [(snapshot, elapsed) for snapshot, elapsed in finished if snapshot.kid_id in kids]  # Deleted kids owe nothing
+        
+        while rows:
+            # One session per kid in each batch; a kid's other sessions wait for the next one
+            batch, later, batch_kids = [], [], set()
+            for snapshot, elapsed in rows:
+                if snapshot.kid_id in batch_kids:
+                    later.append((snapshot, elapsed))
+                else:
+                    batch_kids.add(snapshot.kid_id)
+                    batch.append((snapshot, elapsed))
+            rows = later
+            
+            batch_kids = [kids[snapshot.kid_id] for snapshot, _ in batch]
+            bonus_used = previous_bonus_used = [accounting.to_seconds(kid.daily_bonus_used) for kid in batch_kids]
+            # Never charge more than the session was granted, nor more than the kid had when it started
+            allowances = [
+                min(int(snapshot.duration_seconds),
+                    accounting.available_seconds(accounting.to_seconds(snapshot.original_minutes), used, bonus_time_enabled))
+                for (snapshot, _), used in zip(batch, bonus_used)
+            ]
+            main, bonus_used, deducted = accounting.deduct_batch(
+                [accounting.to_seconds(kid.current_minutes) for kid in batch_kids],
+                bonus_used,
+                [int(round(elapsed)) for _, elapsed in batch],
+                allowances,
+                [bonus_time_enabled] * len(batch)
+            )
+            
+            for kid, main_seconds, bonus_used_seconds, deducted_seconds in zip(batch_kids, main, bonus_used, deducted):
+                kid.current_minutes = accounting.to_minutes(main_seconds)
+                kid.daily_bonus_used = accounting.to_minutes(bonus_used_seconds)
+                session.add(kid)
+                # Create a log entry for the time deduction (points not affected)
+                session.add(LogEntry(
+                    kid_id=kid.id,
+                    time_change=-accounting.to_minutes(deducted_seconds),  # Negative value since time was deducted
+                    points_change=0,  # Points are not affected when a session ends
+                    reason=reason
+                ))
+            analytics.add_usage(session, [
+                {"kid_id": kid.id, "usage_seconds": deducted_seconds, "bonus_seconds": bonus_used_seconds - previous, "sessions": 1}
+                for kid, bonus_used_seconds, previous, deducted_seconds in zip(batch_kids, bonus_used, previous_bonus_used, deducted)
+            ])
+        
+        session.commit()
+        for kid_id in kids:
+            publish_balance(session, kid_id)
+
+def refresh_sessions(session: Session, kid_id: Optional[int] = None):
+    """Re-read the kid names and bonus setting of running sessions after a write changed them"""
+    bonus_time_enabled = admin_config_cache.get(session).bonus_time_enabled
+    for snapshot in app.state.sessions:
+        if kid_id is not None and snapshot.kid_id != kid_id:
+            continue
+        kid = get_kid(session, snapshot.kid_id)
+        if not kid:
+            # The kid was deleted, so the session is over
+            if claim_session(snapshot):
+                journal_event(session, "cancel", snapshot, offset_seconds=snapshot.elapsed_seconds())
+                session.commit()
+                broker.publish("session_stopped", session_ended_payload(snapshot))
+            continue
+        snapshot.kid_name = kid.name
+        snapshot.bonus_time_enabled = bonus_time_enabled
+
+def replay_session_journal():
+    """Restore the sessions that were running when the server stopped, or settle them if their time is up.
+
+    Sessions that ended are compacted out of the journal afterwards.
+    """
+    with Session(engine) as session:
+        ended = set(session.exec(select(SessionEvent.session_id).where(SessionEvent.event != "start")).all())
+        open_starts = [
+            start for start in session.exec(select(SessionEvent).where(SessionEvent.event == "start").order_by(SessionEvent.id)).all()
+            if start.session_id not in ended
+        ]
+        kid_names = dict(session.exec(select(Kid.id, Kid.name)).all())
+    
+    now = datetime.utcnow()
+    expired = []
+    for start in open_starts:
+        # The monotonic clock restarted with the process, so use wall time for the time spent while down
+        elapsed = max(0, (now - start.timestamp).total_seconds())
+        snapshot = SessionSnapshot(
+            kid_id=start.kid_id,
+            kid_name=kid_names.get(start.kid_id, "Unknown"),
+            duration_seconds=start.duration_seconds,
+            original_minutes=start.original_minutes,
+            bonus_time_enabled=start.bonus_time_enabled,
+            device=start.device,
+            session_id=start.session_id,
+            elapsed_seconds=elapsed
+        )
+        if elapsed >= start.duration_seconds or start.kid_id not in kid_names:
+            expired.append((snapshot, snapshot.duration_seconds))
+            continue
+        
+        # Starts are replayed in order, so a later session on the same kid or device wins
+        for displaced in app.state.sessions.add(snapshot):
+            scheduler.cancel(displaced.session_id)
+            settle_session(displaced, displaced.elapsed_seconds(), "Session replaced by a new session", "stop")
+        activate_session(snapshot)
+        print(f"Restored session {snapshot.session_id} for kid {snapshot.kid_id} ({int(snapshot.remaining_seconds())} s left)")
+    
+    # Everything that ran out while the server was down is settled in one batch
+    if expired:
+        settle_sessions(expired, "Session expired while the server was down", "expire")
+        print(f"Settled {len(expired)} expired session(s) after restart")
+    
+    with Session(engine) as session:
+        session.exec(delete(SessionEvent).where(SessionEvent.session_id.in_(
+            select(SessionEvent.session_id).where(SessionEvent.event != "start")
+        )))
+        session.commit()
+
+def rollover_daily_bonus():
+    """Give every kid a fresh daily bonus if it wasn't reset today yet; returns how many kids were reset"""
+    today = str(date.today())
+    with Session(engine) as session:
+        result = session.exec(
+            update(Kid).where(Kid.last_reset_date != today).values(daily_bonus_used=0, last_reset_date=today)
+        )
+        session.commit()
+        return result.rowcount
+
+ROLLOVER_RETRY_SECONDS = 60  # Until a failed bonus reset (e.g. "database is locked") goes through
+
+def daily_rollover():
+    """Reset the daily bonus, scheduling the next reset for local midnight first so a failure can't stop them"""
+    # If the timer fires a little early the reset below is a no-op, and the next one is only moments away
+    next_midnight = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    seconds_to_midnight = max(1, (next_midnight - datetime.now()).total_seconds())
+    scheduler.schedule("daily-rollover", time.monotonic() + seconds_to_midnight, daily_rollover)
+    
+    try:
+        reset = rollover_daily_bonus()
+    except Exception as error:
+        # The scheduler leaves keys that were armed again alone, and the next midnight already is
+        print(f"Error resetting the daily bonus, retrying in {ROLLOVER_RETRY_SECONDS} s: {error}")
+        scheduler.schedule("daily-rollover", time.monotonic() + ROLLOVER_RETRY_SECONDS, daily_rollover)
+        return
+    if reset:
+        print(f"Daily bonus reset for {reset} kid(s)")
+        # Polled pages must not keep answering 304 with the old bonus
+        broker.publish("kids_changed", {"kid_id": None})
+    
+    # Archiving can take a while (it streams every old entry into a file), so it runs on the
+    # scheduler's executor, never on the event loop during startup
+    if archive.LOG_ARCHIVE_DAYS > 0:
+        scheduler.schedule("log-archive", time.monotonic(), archive_old_logs)
+
+def archive_old_logs():
+    """Roll old log entries into daily summaries (see archive.py); tried again at the next midnight if it fails"""
+    try:
+        with Session(engine) as session:
+            result = archive.archive_logs(session, archive.archive_cutoff(archive.LOG_ARCHIVE_DAYS))
+    except Exception as error:  # E.g. LOG_ARCHIVE_DIR not writable or the disk full
+        print(f"Error archiving log entries: {error}")
+        return
+    if result["archived"]:
+        print(f"Archived {result['archived']} log entries to {result['file']}")
+        broker.version.bump()  # /api/logs now shows summaries in their place
+
+def admin_required(request: Request):
+    """Dependency of every admin endpoint: 401 unless the request belongs to an open admin session"""
+    if not is_admin(request):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+def device_required(request: Request):
+    """Dependency of the locker uploads: 401 unless the request carries the device token (see auth.DEVICE_TOKEN)"""
+    client_host = request.client.host if request.client else None
+    if not auth.device_authorized(request.headers.get("X-Device-Token"), client_host):
+        raise HTTPException(status_code=401, detail="Invalid device token")
+
+def admin_settings(session: Session = Depends(get_session)) -> AdminSettings:
+    """Dependency for the admin config, served from memory (see storage.AdminConfigCache)"""
+    return admin_config_cache.get(session)
+
 @app.on_event("startup")
 def startup_event():
     create_db_and_tables()
+    broker.start(asyncio.get_running_loop())
+    scheduler.start(asyncio.get_running_loop())
     
     # Create a default admin config if none exists
     with Session(engine) as session:
-        existing_admin = session.get(AdminConfig, 1)
+        existing_admin = get_admin_config(session)
         if not existing_admin:
             default_admin = AdminConfig(
-                admin_password="admin",  # Default password
+                admin_password=auth.hash_password(auth.DEFAULT_PASSWORD),  # Default password
                 bonus_time_enabled=True  # Bonus time enabled by default
             )
             session.add(default_admin)
             session.commit()
+        elif auth.upgrade_stored_password(existing_admin):
+            # Written in plain text by an older version
+            session.add(existing_admin)
+            session.commit()
+    admin_config_cache.invalidate()
     
     # Create a default kid if none exist
     with Session(engine) as session:
@@ -78,182 +519,251 @@ def startup_event():
         if not existing_kids:
             default_kid = Kid(name="Child1", current_minutes=30, last_reset_date=str(date.today()))
             session.add(default_kid)
+            session.flush()
             # Add a log entry for the initial time allocation
             # Also add the same amount as initial points
             initial_log = LogEntry(
-                kid_id=1,
+                kid_id=default_kid.id,
                 time_change=30,
                 points_change=30,  # Add same amount as initial points
                 reason="Initial time allocation"
             )
             session.add(initial_log)
+            add_points(session, default_kid.id, 30)
+            analytics.add_usage(session, [{"kid_id": default_kid.id, "time_added": 30, "points_change": 30}])
             session.commit()
-
-@app.get("/", response_class=HTMLResponse)
-def read_root(request: Request, session: Session = Depends(get_session)):
-    # Get all kids
-    kids = session.exec(select(Kid)).all()
-    for kid in kids:
-        kid.reset_daily_bonus_if_needed()
-    session.commit()
-    
-    # For the leaderboard, we want to show the sum of points from log entries
-    # rather than the current time balance
-    all_logs = session.exec(select(LogEntry)).all()
     
-    # Calculate total points for each kid (separate from time)
-    kid_points = {}
-    for log in all_logs:
-        # Sum up the points changes (separate from time)
-        if log.kid_id in kid_points:
-            kid_points[log.kid_id] += log.points_change
-        else:
-            kid_points[log.kid_id] = log.points_change
+    # Build (or repair) the leaderboard totals, e.g. for databases created before they existed
+    with Session(engine) as session:
+        repair_points(session)
+        if analytics.backfill_usage(session):
+            print("Built the usage analytics from the activity log")
     
-    # Create a list of tuples (kid, points) and sort by points
-    kid_point_pairs = [(kid, kid_points.get(kid.id, 0)) for kid in kids]
-    sorted_kid_point_pairs = sorted(kid_point_pairs, key=lambda x: x[1], reverse=True)
+    # Catch up on the midnight bonus reset if the server was down, then keep doing it every midnight
+    daily_rollover()
     
-    # Return the sorted list for the template
-    return templates.TemplateResponse("kids.html", {
-        "request": request, 
-        "kids_with_points": sorted_kid_point_pairs
-    })
+    # Bring back the sessions that were running before a restart or crash
+    replay_session_journal()
 
-@app.post("/api/session/start/{kid_id}")
-def start_session(kid_id: int, request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
+async def current_leaderboard(version: str) -> List[dict]:
+    """The ranked leaderboard rows of a state version, read from the database once per version"""
+    rows = leaderboard_cache.get_rows(version)
+    if rows is None:
+        rows = await run_query(leaderboard.leaderboard_rows)
+        leaderboard_cache.put_rows(version, rows)
+    return rows
+
+def render_leaderboard_row(row: dict) -> str:
+    return templates.get_template("leaderboard_item.html").render(kid=row)
+
+async def kids_page() -> str:
+    # The page is the same for everybody, so it is rendered once per state version
+    version = broker.version.etag
+    page = leaderboard_cache.get_page(version)
+    if page is None:
+        rows = await current_leaderboard(version)
+        page = templates.get_template("kids.html").render(leaderboard=rows, version=version)
+        leaderboard_cache.put_page(version, page)
+    return page
+
+@app.get("/", response_class=HTMLResponse)
+async def read_root(request: Request):
+    # Wall tablets reload this page a lot: between writes it comes from memory (or as a 304)
+    return await conditional_response(request, kids_page, response_class=HTMLResponse)
+
+@app.get("/api/kids/delta")
+async def leaderboard_delta(request: Request):
+    """The leaderboard rows that changed since the version the kids page shows, as rendered HTML.
+
+    The page sends its version as If-None-Match: 304 while nothing changed. Pages
+    older than the cached history (or from before a restart) get every row.
+    """
+    async def build():
+        version = broker.version.etag
+        rows = await current_leaderboard(version)
+        return leaderboard_cache.delta(request.headers.get("if-none-match"), version, rows, render_leaderboard_row)
+    return await conditional_response(request, build)
+
+@app.post("/api/session/start/{kid_id}", dependencies=[Depends(admin_required)])
+def start_session(kid_id: int, device: str = DEFAULT_DEVICE, session: Session = Depends(get_session),
+                  settings: AdminSettings = Depends(admin_settings)):
     # Get the kid to record the original time
-    kid = session.get(Kid, kid_id)
-    if kid:
-        # Get admin config to check if bonus time is enabled
-        admin_config = session.get(AdminConfig, 1)
-        bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
-        
-        # Reset daily bonus if needed (only if bonus is enabled)
-        if bonus_time_enabled:
-            kid.reset_daily_bonus_if_needed()
-        
-        # Calculate total available time
-        main_time = max(0, kid.current_minutes)
-        bonus_available = 0  # Don't include bonus if disabled
-        if bonus_time_enabled:
-            bonus_available = max(0, 15 - kid.daily_bonus_used)
-        total_available_seconds = (main_time + bonus_available) * 60
-        
-        app.state.original_time_at_session_start = kid.current_minutes  # Record original time for accurate deduction
-        app.state.time_remaining_at_start = total_available_seconds  # Record initial time
+    kid = get_kid(session, kid_id)
+    if not kid:
+        raise HTTPException(status_code=404, detail="Kid not found")
+    end_sessions_in_the_way(session, kid, device)
     
-    global active_kid_id
-    app.state.active_kid_id = kid_id
+    bonus_time_enabled = settings.bonus_time_enabled
+    total_available_seconds = session_allowance(kid, bonus_time_enabled)
+    
+    start_session_snapshot(session, kid, total_available_seconds, bonus_time_enabled, device)
     return {"message": f"Session started for kid {kid_id}"}
 
 @app.get("/api/session/status")
-def session_status():
-    kid_id = app.state.active_kid_id
-    
-    if not kid_id:
+async def session_status(request: Request, session_id: Optional[str] = None, kid_id: Optional[int] = None, device: Optional[str] = None):
+    # On 304 the client keeps counting down from the time_remaining_seconds it already has
+    return await conditional_response(request, lambda: session_status_payload(session_id, kid_id, device))
+
+@app.get("/api/session/wait")
+async def wait_for_session_change(request: Request, device: str = DEFAULT_DEVICE, timeout: float = 30):
+    """Long poll for pc_locker.pyw: answers as soon as the device's session starts, stops or expires.
+
+    The ETag names the device's current session. While it matches the client's
+    If-None-Match the request waits, for up to `timeout` seconds, then answers 304.
+    """
+    timeout = max(0, min(timeout, 60))
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + timeout
+    # Subscribe before looking at the session, so a change in between still wakes us
+    queue = broker.subscribe()
+    try:
+        while True:
+            snapshot = app.state.sessions.for_device(device)
+            etag = f'"{snapshot.session_id if snapshot else "idle"}"'
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if not not_modified(request, etag):
+                return JSONResponse(session_status_payload(None, None, device), headers=headers)
+            
+            time_left = give_up_at - loop.time()
+            if time_left <= 0:
+                return Response(status_code=304, headers=headers)
+            try:
+                # Any event may be the one (the server's deadline timer publishes session_expired); look again
+                await asyncio.wait_for(queue.get(), timeout=time_left)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        broker.unsubscribe(queue)
+
+def session_status_payload(session_id: Optional[str], kid_id: Optional[int], device: Optional[str]):
+    # Answered from the in-memory snapshot, the database is never touched
+    snapshot = app.state.sessions.find(session_id, kid_id, device)
+    if not snapshot:
         return {"is_active": False, "time_remaining_seconds": 0}
     
-    with Session(engine) as db_session:
-        kid = db_session.get(Kid, kid_id)
-        if not kid:
-            return {"is_active": False, "time_remaining_seconds": 0}
-        
-        # Get admin config to check if bonus time is enabled
-        admin_config = db_session.get(AdminConfig, 1)
-        bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
-        
-        # Reset daily bonus if needed (only if bonus time is enabled)
-        if bonus_time_enabled:
-            kid.reset_daily_bonus_if_needed()
-        
-        # Calculate initial total time available at session start
-        # Use the original time at session start to maintain consistency
-        main_time = max(0, app.state.original_time_at_session_start)
-        bonus_available = 0  # Don't include bonus if disabled
-        if bonus_time_enabled:
-            bonus_available = max(0, 15 - kid.daily_bonus_used)  # Use current bonus used at session start
-        initial_total_seconds = (main_time + bonus_available) * 60
-        
-        # If session just started, record the start time and initial time
-        if app.state.session_start_time is None:
-            app.state.session_start_time = datetime.utcnow()
-            app.state.time_remaining_at_start = initial_total_seconds
-            app.state.original_time_at_session_start = kid.current_minutes  # Record original time for accurate deduction
-        
-        # Calculate elapsed time since session started
-        current_time = datetime.utcnow()
-        total_elapsed = (current_time - app.state.session_start_time).total_seconds()
-        
-        # Calculate remaining time
-        time_remaining = max(0, app.state.time_remaining_at_start - total_elapsed)
-        
-        # If time is up, return 0
-        if time_remaining <= 0:
-            return {
-                "is_active": True,
-                "time_remaining_seconds": 0,
-                "kid_id": kid_id,
-                "kid_name": kid.name
-            }
-        
-        return {
-            "is_active": True,
-            "time_remaining_seconds": time_remaining,
-            "kid_id": kid_id,
-            "kid_name": kid.name
-        }
+    return {
+        "is_active": True,
+        "time_remaining_seconds": snapshot.remaining_seconds(),
+        "kid_id": snapshot.kid_id,
+        "kid_name": snapshot.kid_name,
+        "session_id": snapshot.session_id,
+        "device": snapshot.device
+    }
 
-@app.get("/api/kids")
-def get_kids(session: Session = Depends(get_session)):
+@app.get("/api/sessions")
+async def list_sessions():
+    """All running sessions (one per kid and per device)"""
+    return {"sessions": [session_payload(snapshot) for snapshot in app.state.sessions]}
+
+def list_kids(session: Session):
     kids = session.exec(select(Kid)).all()
-    return [{"id": kid.id, "name": kid.name, "minutes": kid.current_minutes} for kid in kids]
+    return [{"id": kid.id, "name": kid.name, "minutes": accounting.display_minutes(kid.current_minutes)} for kid in kids]
 
-@app.get("/admin", response_class=HTMLResponse)
-def admin_page(request: Request, session: Session = Depends(get_session)):
-    if request.session.get("admin_authenticated"):
+@app.get("/api/kids")
+async def get_kids(request: Request):
+    # Async or threadpool database access, depending on DB_ASYNC (see storage.py)
+    return await conditional_response(request, lambda: run_query(list_kids))
+
+def event_for_device(message: dict, device: Optional[str]) -> bool:
+    """Session events go to the clients of their device, everything else to everybody"""
+    return device is None or message["data"].get("device", device) == device
+
+@app.get("/api/events")
+async def events_stream(request: Request, device: Optional[str] = None):
+    """Server-sent events: session_started/stopped/expired, balance_changed and kids_changed.
+
+    The first event is the current session state (of `device`, if given), so clients
+    don't need a separate fetch. With `device`, only that device's session events are sent.
+    /api/active-session and /api/session/status stay available for clients that poll.
+    """
+    async def stream():
+        queue = broker.subscribe()
+        try:
+            yield format_sse("session", session_payload(app.state.sessions.find(device=device)))
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies and idle connections alive
+                    yield ": keep-alive\n\n"
+                    continue
+                if event_for_device(message, device):
+                    yield format_sse(message["type"], message["data"])
+        finally:
+            broker.unsubscribe(queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.websocket("/ws/events")
+async def events_websocket(websocket: WebSocket, device: Optional[str] = None):
+    """Same events as /api/events, as JSON messages {"type": ..., "data": ...}"""
+    await websocket.accept()
+    queue = broker.subscribe()
+    
+    async def forward_events():
+        await websocket.send_json({"type": "session", "data": session_payload(app.state.sessions.find(device=device))})
+        while True:
+            message = await queue.get()
+            if event_for_device(message, device):
+                await websocket.send_json(message)
+    
+    sender = asyncio.create_task(forward_events())
+    try:
+        while True:
+            await websocket.receive_text()  # Raises WebSocketDisconnect when the client goes away
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        broker.unsubscribe(queue)
+
+def render_admin_page(session: Session, request: Request):
+    if is_admin(request):
         kids = session.exec(select(Kid)).all()
-        # Get admin config to check bonus time status
-        admin_config = session.get(AdminConfig, 1)
-        bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
+        bonus_time_enabled = admin_config_cache.get(session).bonus_time_enabled
         return templates.TemplateResponse("admin.html", {
             "request": request, 
+            "admin_authenticated": True,
             "kids": kids, 
             "bonus_time_enabled": bonus_time_enabled
         })
     else:
-        return templates.TemplateResponse("admin.html", {"request": request})
+        return templates.TemplateResponse("admin.html", {"request": request, "admin_authenticated": False})
+
+@app.get("/admin", response_class=HTMLResponse)
+def admin_page(request: Request, session: Session = Depends(get_session)):
+    return render_admin_page(session, request)
 
 @app.post("/admin/login")
-def login(request: Request, password: str = Form(...), session: Session = Depends(get_session)):
-    if verify_password(password, session):
-        request.session["admin_authenticated"] = True
-        kids = session.exec(select(Kid)).all()
-        return templates.TemplateResponse("admin.html", {"request": request, "kids": kids})
+async def login(request: Request, password: str = Form(...)):
+    if await verify_password(password):
+        admin_sessions.revoke(request.session.get("admin_session"))
+        request.session["admin_session"] = admin_sessions.create()
+        return await run_query(render_admin_page, request)
     else:
         return templates.TemplateResponse("admin.html", {
             "request": request, 
+            "admin_authenticated": False,
             "error": "Invalid password"
         })
 
-@app.post("/admin/time")
+@app.post("/admin/logout")
+def logout(request: Request):
+    admin_sessions.revoke(request.session.pop("admin_session", None))
+    return RedirectResponse("/admin", status_code=303)
+
+@app.post("/admin/time", dependencies=[Depends(admin_required)])
 def update_time(
-    request: Request,
     kid_id: int = Form(...),
     minutes: int = Form(...),
     reason: str = Form(...),
     session: Session = Depends(get_session)
 ):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
     # Get the kid
-    kid = session.get(Kid, kid_id)
+    kid = get_kid(session, kid_id)
     if not kid:
         return HTMLResponse(content="Kid not found", status_code=404)
     
@@ -269,25 +779,23 @@ def update_time(
         reason=reason
     )
     session.add(log_entry)
+    add_points(session, kid_id, minutes)
+    analytics.add_usage(session, [{"kid_id": kid_id, "time_added": minutes, "points_change": minutes}])
     session.commit()
+    publish_balance(session, kid_id)
     
     return RedirectResponse(url="/admin", status_code=303)
 
 
-@app.post("/admin/points")
+@app.post("/admin/points", dependencies=[Depends(admin_required)])
 def update_points(
-    request: Request,
     kid_id: int = Form(...),
     points: int = Form(...),
     reason: str = Form(...),
     session: Session = Depends(get_session)
 ):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
     # Get the kid
-    kid = session.get(Kid, kid_id)
+    kid = get_kid(session, kid_id)
     if not kid:
         return HTMLResponse(content="Kid not found", status_code=404)
     
@@ -299,26 +807,106 @@ def update_points(
         reason=reason
     )
     session.add(log_entry)
+    add_points(session, kid_id, points)
+    analytics.add_usage(session, [{"kid_id": kid_id, "points_change": points}])
     session.commit()
+    publish_balance(session, kid_id)
     
     return RedirectResponse(url="/admin", status_code=303)
 
 
-@app.post("/admin/add_kid")
+# Increments for bulk_adjust, so a write that commits between its read and its write isn't lost.
+# A run of "max(-5, minutes + change)" steps (as in update_time) always comes down to max(floor, minutes + total).
+ADD_MINUTES = (
+    update(Kid.__table__)
+    .where(Kid.__table__.c.id == bindparam("kid"))
+    .values(current_minutes=func.max(bindparam("floor"), Kid.__table__.c.current_minutes + bindparam("total")))
+)
+ADD_POINTS = (
+    update(KidPoints.__table__)
+    .where(KidPoints.__table__.c.kid_id == bindparam("kid"))
+    .values(points=KidPoints.__table__.c.points + bindparam("total"))
+)
+
+@app.post("/admin/bulk_adjust", dependencies=[Depends(admin_required)])
+def bulk_adjust(adjustments: List[Adjustment], session: Session = Depends(get_session)):
+    """Apply many time/points adjustments in one transaction, e.g. +10 minutes to all kids for chores.
+
+    Rows that can't be applied (unknown kid or kind) are reported and skipped; the rest
+    still go through. Returns one result per row, in order.
+    """
+    # Everything is worked out in memory as changes per kid...
+    all_kid_ids = session.exec(select(Kid.id)).all()
+    known = set(all_kid_ids)
+    minutes = {}  # Kid id -> [floor, total] of its time changes
+    points = {}  # Kid id -> total points change
+    log_rows, results = [], []
+    
+    for index, adjustment in enumerate(adjustments):
+        kid_ids = all_kid_ids if adjustment.kid_id is None else [adjustment.kid_id]
+        if adjustment.kind not in ("time", "points"):
+            results.append({"index": index, "kid_id": adjustment.kid_id, "status": "error", "detail": f"Unknown kind {adjustment.kind!r}"})
+            continue
+        if adjustment.kid_id is not None and adjustment.kid_id not in known:
+            results.append({"index": index, "kid_id": adjustment.kid_id, "status": "error", "detail": "Kid not found"})
+            continue
+        
+        for kid_id in kid_ids:
+            time_change = adjustment.amount if adjustment.kind == "time" else 0
+            if time_change:
+                change = minutes.get(kid_id)
+                if change is None:
+                    minutes[kid_id] = [-5, time_change]
+                else:
+                    change[0] = max(-5, change[0] + time_change)
+                    change[1] += time_change
+            points[kid_id] = points.get(kid_id, 0) + adjustment.amount
+            log_rows.append({"kid_id": kid_id, "time_change": time_change, "points_change": adjustment.amount, "reason": adjustment.reason})
+        results.append({"index": index, "kid_id": adjustment.kid_id, "status": "ok", "kids": len(kid_ids)})
+    
+    # ...and applied as increments with one executemany per table. The first write takes SQLite's
+    # write lock, so the balances read back below are the ones this transaction committed.
+    if log_rows:
+        session.exec(insert(LogEntry), params=log_rows)
+        analytics.add_usage(session, [
+            {"kid_id": row["kid_id"], "time_added": row["time_change"], "points_change": row["points_change"]} for row in log_rows
+        ])
+    if minutes:
+        session.exec(ADD_MINUTES, params=[{"kid": kid_id, "floor": floor, "total": total} for kid_id, (floor, total) in minutes.items()])
+    if points:
+        existing = set(session.exec(select(KidPoints.kid_id).where(KidPoints.kid_id.in_(points))).all())
+        if existing:
+            session.exec(ADD_POINTS, params=[{"kid": kid_id, "total": points[kid_id]} for kid_id in existing])
+        if points.keys() - existing:
+            session.exec(insert(KidPoints), params=[{"kid_id": kid_id, "points": points[kid_id]} for kid_id in points.keys() - existing])
+    changed = minutes.keys() | points.keys()
+    balances = session.exec(
+        select(Kid.id, Kid.current_minutes, func.coalesce(KidPoints.points, 0))
+        .outerjoin(KidPoints, KidPoints.kid_id == Kid.id)
+        .where(Kid.id.in_(changed))
+    ).all() if changed else []
+    session.commit()
+    
+    for kid_id, kid_minutes, kid_points in balances:
+        broker.publish("balance_changed", {"kid_id": kid_id, "minutes": accounting.display_minutes(kid_minutes), "points": kid_points})
+    
+    return {
+        "applied": sum(1 for result in results if result["status"] == "ok"),
+        "failed": sum(1 for result in results if result["status"] == "error"),
+        "results": results
+    }
+
+
+@app.post("/admin/add_kid", dependencies=[Depends(admin_required)])
 def add_kid(
-    request: Request,
     name: str = Form(...),
     initial_minutes: int = Form(30),
     session: Session = Depends(get_session)
 ):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
     # Create new kid
     new_kid = Kid(name=name, current_minutes=initial_minutes, last_reset_date=str(date.today()))
     session.add(new_kid)
-    session.commit()
+    session.flush()
     
     # Create log entry for initial time allocation
     # Also add the same amount as initial points
@@ -329,24 +917,22 @@ def add_kid(
         reason="Initial time allocation"
     )
     session.add(initial_log)
+    session.add(KidPoints(kid_id=new_kid.id, points=initial_minutes))
+    analytics.add_usage(session, [{"kid_id": new_kid.id, "time_added": initial_minutes, "points_change": initial_minutes}])
     session.commit()
+    broker.publish("kids_changed", {"kid_id": new_kid.id})
     
     return RedirectResponse(url="/admin", status_code=303)
 
 
-@app.post("/admin/edit_kid")
+@app.post("/admin/edit_kid", dependencies=[Depends(admin_required)])
 def edit_kid(
-    request: Request,
     kid_id: int = Form(...),
     name: str = Form(...),
     session: Session = Depends(get_session)
 ):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
     # Get the kid
-    kid = session.get(Kid, kid_id)
+    kid = get_kid(session, kid_id)
     if not kid:
         return HTMLResponse(content="Kid not found", status_code=404)
     
@@ -354,231 +940,130 @@ def edit_kid(
     kid.name = name
     session.add(kid)
     session.commit()
+    refresh_sessions(session, kid_id)
+    broker.publish("kids_changed", {"kid_id": kid_id})
     
     return RedirectResponse(url="/admin", status_code=303)
 
 
-@app.post("/admin/delete_kid")
+@app.post("/admin/delete_kid", dependencies=[Depends(admin_required)])
 def delete_kid(
-    request: Request,
     kid_id: int = Form(...),
     session: Session = Depends(get_session)
 ):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
     # Get the kid
-    kid = session.get(Kid, kid_id)
+    kid = get_kid(session, kid_id)
     if not kid:
         return HTMLResponse(content="Kid not found", status_code=404)
     
-    # Delete the kid
+    # Delete the kid, its leaderboard total and its analytics
     session.delete(kid)
+    session.exec(delete(KidPoints).where(KidPoints.kid_id == kid_id))
+    session.exec(delete(UsageDaily).where(UsageDaily.kid_id == kid_id))
     session.commit()
+    refresh_sessions(session, kid_id)
+    broker.publish("kids_changed", {"kid_id": kid_id})
     
     return RedirectResponse(url="/admin", status_code=303)
 
 
-@app.post("/admin/start_session/{kid_id}")
-def admin_start_session(kid_id: int, request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
+@app.post("/admin/start_session/{kid_id}", dependencies=[Depends(admin_required)])
+def admin_start_session(kid_id: int, device: str = DEFAULT_DEVICE, session: Session = Depends(get_session),
+                        settings: AdminSettings = Depends(admin_settings)):
     # Get the kid to check available time
-    kid = session.get(Kid, kid_id)
+    kid = get_kid(session, kid_id)
     if not kid:
         raise HTTPException(status_code=404, detail="Kid not found")
+    end_kid_session(session, kid)
     
-    # Get admin config to check if bonus time is enabled
-    admin_config = session.get(AdminConfig, 1)
-    bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
-    
-    # Reset daily bonus if needed (only if bonus is enabled)
-    if bonus_time_enabled:
-        kid.reset_daily_bonus_if_needed()
-    
-    # Calculate total available time
-    main_time = max(0, kid.current_minutes)
-    bonus_available = 0  # Don't include bonus if disabled
-    if bonus_time_enabled:
-        bonus_available = max(0, 15 - kid.daily_bonus_used)
-    total_available_seconds = (main_time + bonus_available) * 60
+    bonus_time_enabled = settings.bonus_time_enabled
+    total_available_seconds = session_allowance(kid, bonus_time_enabled)
     
     # If no time available, don't start session
     if total_available_seconds <= 0:
         raise HTTPException(status_code=400, detail="No time available for this kid")
+    end_device_session(device)
     
-    app.state.active_kid_id = kid_id
-    app.state.session_start_time = datetime.utcnow()  # Record when session started
-    app.state.time_remaining_at_start = total_available_seconds  # Record initial time
-    app.state.original_time_at_session_start = kid.current_minutes  # Record original time for accurate deduction
-    
-    return {"message": f"Session started for kid {kid_id}"}
+    snapshot = start_session_snapshot(session, kid, total_available_seconds, bonus_time_enabled, device)
+    return {"message": f"Session started for kid {kid_id}", "session_id": snapshot.session_id}
 
 
-@app.post("/admin/start_session_with_time")
+@app.post("/admin/start_session_with_time", dependencies=[Depends(admin_required)])
 def admin_start_session_with_time(
-    request: Request,
     kid_id: int = Form(...),
     session_time: int = Form(...),
-    session: Session = Depends(get_session)
+    device: str = Form(DEFAULT_DEVICE),
+    session: Session = Depends(get_session),
+    settings: AdminSettings = Depends(admin_settings)
 ):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
     # Get the kid to check available time
-    kid = session.get(Kid, kid_id)
+    kid = get_kid(session, kid_id)
     if not kid:
         raise HTTPException(status_code=404, detail="Kid not found")
     
     # Validate that requested session time is positive
     if session_time <= 0:
         raise HTTPException(status_code=400, detail="Session time must be greater than 0")
+    end_kid_session(session, kid)
     
-    # Get admin config to check if bonus time is enabled
-    admin_config = session.get(AdminConfig, 1)
-    bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
-    
-    # Reset daily bonus if needed (only if bonus is enabled)
-    if bonus_time_enabled:
-        kid.reset_daily_bonus_if_needed()
-    
-    # Calculate total available time
-    main_time = max(0, kid.current_minutes)
-    bonus_available = 0  # Don't include bonus if disabled
-    if bonus_time_enabled:
-        bonus_available = max(0, 15 - kid.daily_bonus_used)
-    total_available_seconds = (main_time + bonus_available) * 60
+    bonus_time_enabled = settings.bonus_time_enabled
+    total_available_seconds = session_allowance(kid, bonus_time_enabled)
     
     # If no time available, don't start session
     if total_available_seconds <= 0:
         raise HTTPException(status_code=400, detail="No time available for this kid")
+    end_device_session(device)
     
     # Use the custom session time (convert to seconds), but don't exceed available time
     requested_seconds = session_time * 60
     actual_session_seconds = min(requested_seconds, total_available_seconds)
     
-    app.state.active_kid_id = kid_id
-    app.state.session_start_time = datetime.utcnow()  # Record when session started
-    app.state.time_remaining_at_start = actual_session_seconds  # Record initial time
-    app.state.original_time_at_session_start = kid.current_minutes  # Record original time for accurate deduction
-    
-    return {"message": f"Session started for kid {kid_id} with {session_time} minutes"}
-
+    snapshot = start_session_snapshot(session, kid, actual_session_seconds, bonus_time_enabled, device)
+    return {"message": f"Session started for kid {kid_id} with {session_time} minutes", "session_id": snapshot.session_id}
 
-import subprocess
-import platform
 
-def lock_screen():
-    """Function to lock the computer screen"""
-    try:
-        system = platform.system()
-        if system == "Windows":
-            subprocess.run(["rundll32.exe", "user32.dll,LockWorkStation"])
-        elif system == "Darwin":  # macOS
-            subprocess.run(["pmset", "displaysleepnow"])
-        elif system == "Linux":
-            subprocess.run(["xdg-screensaver", "lock"])
-    except Exception as e:
-        print(f"Error locking screen: {e}")
-
-@app.post("/admin/stop_session")
-def admin_stop_session(request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    kid_id = app.state.active_kid_id
-    if kid_id:
-        # Get the kid from database
-        kid = session.get(Kid, kid_id)
-        if kid:
-            # Get admin config to check if bonus time is enabled
-            admin_config = session.get(AdminConfig, 1)
-            bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
-            
-            # Reset daily bonus if needed (only if bonus is enabled)
-            if bonus_time_enabled:
-                kid.reset_daily_bonus_if_needed()
-            
-            # Calculate total elapsed time at the moment of stopping
-            current_time = datetime.utcnow()
-            if app.state.session_start_time:
-                # Calculate from start to now
-                total_elapsed = (current_time - app.state.session_start_time).total_seconds()
-            else:
-                total_elapsed = 0
-            
-            # Calculate total time that should be deducted based on original time at session start
-            original_main_time = max(0, app.state.original_time_at_session_start)
-            original_bonus_available = 0  # Don't include bonus if disabled
-            if bonus_time_enabled:
-                original_bonus_available = max(0, 15 - kid.daily_bonus_used)  # Use current bonus used at session start
-            initial_total_seconds = (original_main_time + original_bonus_available) * 60
-            
-            # Use the minimum of elapsed time and initial available time
-            total_elapsed = min(total_elapsed, initial_total_seconds)
-            
-            # Deduct the elapsed time from the kid's time
-            total_elapsed_minutes = round(total_elapsed / 60.0, 1)  # Round to 1 decimal place to avoid floating point issues
-            
-            # Store the original time to calculate the change
-            original_time = kid.current_minutes
-            
-            # First, try to deduct from main time
-            if kid.current_minutes > 0:
-                kid.current_minutes = max(-5, round(kid.current_minutes - total_elapsed_minutes, 1))
-                
-                # If main time went negative and bonus is enabled, use bonus time for the remainder
-                if bonus_time_enabled and kid.current_minutes < 0:
-                    remaining_to_deduct = abs(kid.current_minutes)  # How much more to deduct
-                    kid.daily_bonus_used = min(15, round(kid.daily_bonus_used + remaining_to_deduct, 1))
-                    kid.current_minutes = -5  # Cap at -5
-            elif bonus_time_enabled and kid.daily_bonus_used < 15:
-                # If main time was already exhausted, deduct from bonus time
-                kid.daily_bonus_used = min(15, round(kid.daily_bonus_used + total_elapsed_minutes, 1))
-            
-            # Calculate the actual time change for the log entry
-            # Since we're deducting time, the change should be negative
-            actual_time_change = -total_elapsed_minutes
-            
-            # Create a log entry for the time deduction (points not affected)
-            log_entry = LogEntry(
-                kid_id=kid_id,
-                time_change=actual_time_change,  # Negative value since time was deducted
-                points_change=0,  # Points are not affected during session stop
-                reason="Session manually stopped by admin"
-            )
-            session.add(log_entry)
-            session.add(kid)
-            session.commit()
-    
-    # Reset all session tracking
-    app.state.active_kid_id = None
-    app.state.session_start_time = None
-    app.state.time_remaining_at_start = 0
-    app.state.original_time_at_session_start = 0
-    
-    # Lock the screen after stopping the session
-    lock_screen()
-    
-    return {"message": "Session stopped and time deducted"}
+# Locks this machine's screen in the background (see locking.py)
+screen_locker = ScreenLocker()
 
+def lock_screen(device: str):
+    """Queue a screen lock if the session was on this machine; the request doesn't wait for it, see /api/lock/status"""
+    # ESP32 displays and remote lockers enforce their own sessions
+    if device in (DEFAULT_DEVICE, LOCAL_DEVICE):
+        screen_locker.lock_screen()
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text format
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
+@app.get("/api/lock/status")
+async def lock_status():
+    # How the last screen lock went (backend, errors, locks still queued)
+    return screen_locker.get_status()
 
-@app.post("/admin/toggle_bonus_time")
-def admin_toggle_bonus_time(request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
+@app.post("/admin/stop_session", dependencies=[Depends(admin_required)])
+def admin_stop_session(
+    session_id: Optional[str] = Form(None),
+    kid_id: Optional[int] = Form(None),
+    device: Optional[str] = Form(None)
+):
+    # Stop the given session (by id, kid or device), or the latest one
+    snapshot = app.state.sessions.find(session_id, kid_id, device)
+    if snapshot and claim_session(snapshot):
+        # Deduct the time elapsed at the moment of stopping
+        settle_session(snapshot, snapshot.elapsed_seconds(), "Session manually stopped by admin", "stop")
+        broker.publish("session_stopped", session_ended_payload(snapshot))
+        # Lock the screen after stopping the session
+        lock_screen(snapshot.device)
     
+    return {"message": "Session stopped and time deducted"}
+
+
+@app.post("/admin/toggle_bonus_time", dependencies=[Depends(admin_required)])
+def admin_toggle_bonus_time(session: Session = Depends(get_session)):
     # Get the admin config
-    admin_config = session.get(AdminConfig, 1)
+    admin_config = get_admin_config(session)
     if not admin_config:
         raise HTTPException(status_code=404, detail="Admin config not found")
     
@@ -586,130 +1071,68 @@ def admin_toggle_bonus_time(request: Request, session: Session = Depends(get_ses
     admin_config.bonus_time_enabled = not admin_config.bonus_time_enabled
     session.add(admin_config)
     session.commit()
+    admin_config_cache.update(admin_config)
+    refresh_sessions(session)
     
     status = "enabled" if admin_config.bonus_time_enabled else "disabled"
     return {"message": f"Bonus time {status}"}
 
 
-@app.get("/admin/logs")
-def get_logs(request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
+@app.get("/admin/logs", dependencies=[Depends(admin_required)])
+def get_logs(session: Session = Depends(get_session)):
     # Get all log entries, ordered by timestamp (newest first)
     logs = session.exec(select(LogEntry).order_by(LogEntry.timestamp.desc())).all()
     return {"logs": logs}
 
 
-# Track the last actual deduction time and state to calculate effective time
-last_deduction_state = {
-    'kid_id': None,
-    'current_minutes': 0,
-    'daily_bonus_used': 0,
-    'timestamp': datetime.utcnow()
-}
-
 @app.get("/api/active-session")
-def active_session():
-    kid_id = app.state.active_kid_id
-    
-    if not kid_id:
-        # Reset all session tracking when no active session
-        app.state.session_start_time = None
-        app.state.time_remaining_at_start = 0
-        return {"is_active": False, "active_kid": None}
-    
-    # Get the kid from database to get name
-    with Session(engine) as db_session:
-        kid = db_session.get(Kid, kid_id)
-        if not kid:
-            return {"is_active": False, "active_kid": None}
-        
-        # Get admin config to check if bonus time is enabled
-        admin_config = db_session.get(AdminConfig, 1)
-        bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
-        
-        # Reset daily bonus if needed (for consistency, only if bonus is enabled)
-        if bonus_time_enabled:
-            kid.reset_daily_bonus_if_needed()
-        
-        # Calculate initial total time available at session start
-        # Use the original time at session start to maintain consistency
-        main_time = max(0, app.state.original_time_at_session_start)
-        bonus_available = 0  # Don't include bonus if disabled
-        if bonus_time_enabled:
-            bonus_available = max(0, 15 - kid.daily_bonus_used)  # Use current bonus used at session start
-        initial_total_seconds = (main_time + bonus_available) * 60
-        
-        # If session just started, initialize tracking
-        if app.state.session_start_time is None:
-            app.state.session_start_time = datetime.utcnow()
-            app.state.time_remaining_at_start = initial_total_seconds
-            app.state.original_time_at_session_start = kid.current_minutes  # Record original time for accurate deduction
-        
-        # Calculate elapsed time since session started
-        current_time = datetime.utcnow()
-        total_elapsed = (current_time - app.state.session_start_time).total_seconds()
-        
-        # Calculate remaining time
-        time_remaining = max(0, app.state.time_remaining_at_start - total_elapsed)
-        
-        return {
-            "is_active": True,
-            "active_kid": {
-                "id": kid.id,
-                "name": kid.name,
-                "time_remaining_seconds": time_remaining
-            }
-        }
+async def active_session(request: Request, session_id: Optional[str] = None, kid_id: Optional[int] = None, device: Optional[str] = None):
+    # The given session (by id, kid or device), or the latest one.
+    # On 304 the client keeps counting down from the time_remaining_seconds it already has
+    return await conditional_response(request, lambda: session_payload(app.state.sessions.find(session_id, kid_id, device)))
 
 
-@app.post("/admin/recalculate_points")
-def recalculate_points(request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    # Get all log entries
-    all_logs = session.exec(select(LogEntry)).all()
-    
-    # Calculate total points for each kid from logs
-    kid_points = {}
-    for log in all_logs:
-        if log.kid_id in kid_points:
-            kid_points[log.kid_id] += log.points_change
-        else:
-            kid_points[log.kid_id] = log.points_change
+@app.post("/admin/recalculate_points", dependencies=[Depends(admin_required)])
+def recalculate_points(session: Session = Depends(get_session)):
+    # Verify the leaderboard totals against the logs and repair any drift
+    kid_points, repaired = repair_points(session)
     
     # Return the recalculated points for verification
-    return {"message": "Points recalculated successfully", "kid_points": kid_points}
+    return {
+        "message": "Points recalculated successfully",
+        "kid_points": kid_points,
+        "repaired_kid_ids": repaired
+    }
 
 
-@app.post("/admin/delete_log/{log_id}")
-def delete_log(log_id: int, request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
+@app.post("/admin/archive_logs", dependencies=[Depends(admin_required)])
+def admin_archive_logs(days: int = Form(archive.LOG_ARCHIVE_DAYS), session: Session = Depends(get_session)):
+    if days < 1:
+        raise HTTPException(status_code=400, detail="Keep at least one day of detailed logs")
     
+    # Archive everything before the last `days` days now, instead of waiting for midnight
+    return archive.archive_logs(session, archive.archive_cutoff(days))
+
+
+@app.post("/admin/delete_log/{log_id}", dependencies=[Depends(admin_required)])
+def delete_log(log_id: int, session: Session = Depends(get_session)):
     # Get the log entry
     log = session.get(LogEntry, log_id)
     if not log:
         raise HTTPException(status_code=404, detail="Log entry not found")
     
-    # Delete the log entry
+    # Delete the log entry and take its points back out of the leaderboard total and that day's analytics
     session.delete(log)
+    add_points(session, log.kid_id, -log.points_change)
+    analytics.add_usage(session, [{"kid_id": log.kid_id, "day": analytics.usage_day(log.timestamp), "points_change": -log.points_change}])
     session.commit()
+    publish_balance(session, log.kid_id)
     
     return {"message": "Log entry deleted successfully"}
 
 
-@app.post("/admin/update_log_reason/{log_id}")
-def update_log_reason(log_id: int, request: Request, reason: str = Form(...), session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
+@app.post("/admin/update_log_reason/{log_id}", dependencies=[Depends(admin_required)])
+def update_log_reason(log_id: int, reason: str = Form(...), session: Session = Depends(get_session)):
     # Get the log entry
     log = session.get(LogEntry, log_id)
     if not log:
@@ -723,107 +1146,263 @@ def update_log_reason(log_id: int, request: Request, reason: str = Form(...), se
     return {"message": "Log reason updated successfully"}
 
 
+def expire_session(snapshot: SessionSnapshot) -> bool:
+    """Deduct an expired session's time, log it, lock the screen and tell the clients.
+
+    Used by the ESP32's time-expired call and by the server's own deadline timer.
+    Returns False if the session had already ended.
+    """
+    if not claim_session(snapshot):
+        return False
+    finish_expired_session(snapshot)
+    return True
+
+def finish_expired_session(snapshot: SessionSnapshot):
+    """The part of expire_session after the claim"""
+    # The session ran its full length (never more than the time that was available)
+    settle_session(snapshot, snapshot.duration_seconds, "Time expired - session ended", "expire")
+    
+    # Lock the screen when time expires
+    lock_screen(snapshot.device)
+    broker.publish("session_expired", session_ended_payload(snapshot))
+
+def retry_expire_session(snapshot: SessionSnapshot):
+    """The deadline timer's next attempt after expire_session raised.
+
+    Expiring again would find the session claimed and skip it, losing the
+    deduction, so a claimed session is settled here unless the journal
+    shows that already went through.
+    """
+    if app.state.sessions.get(snapshot.session_id) is snapshot:
+        expire_session(snapshot)  # It failed before the claim
+        return
+    with Session(engine) as session:
+        ended = session.exec(
+            select(SessionEvent.id).where(SessionEvent.session_id == snapshot.session_id, SessionEvent.event != "start")
+        ).first()
+    if ended is None:
+        finish_expired_session(snapshot)
+
+
 @app.post("/api/active-session/time-expired")
-def time_expired_endpoint(request: Request, session: Session = Depends(get_session)):
+def time_expired_endpoint(request: Request, device: Optional[str] = None):
     # Note: This endpoint is called from the ESP32 which doesn't have admin session
     # We'll allow this without authentication for now
     
-    # Get the currently active kid
-    kid_id = app.state.active_kid_id
-    if kid_id:
-        # Get the kid from database
-        kid = session.get(Kid, kid_id)
-        if kid:
-            # Get admin config to check if bonus time is enabled
-            admin_config = session.get(AdminConfig, 1)
-            bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
-            
-            # Reset daily bonus if needed (only if bonus is enabled)
-            if bonus_time_enabled:
-                kid.reset_daily_bonus_if_needed()
-            
-            # Calculate total elapsed time based on original time at session start
-            original_main_time = max(0, app.state.original_time_at_session_start)
-            original_bonus_available = 0  # Don't include bonus if disabled
-            if bonus_time_enabled:
-                original_bonus_available = max(0, 15 - kid.daily_bonus_used)  # Use current bonus used at session start
-            initial_total_seconds = (original_main_time + original_bonus_available) * 60
-            
-            # Calculate total elapsed time (which should be the full initial time since it expired)
-            total_elapsed = initial_total_seconds
-            
-            # Deduct the elapsed time from the kid's time
-            total_elapsed_minutes = round(total_elapsed / 60.0, 1)  # Round to 1 decimal place to avoid floating point issues
-            
-            # Store the original time to calculate the change
-            original_time = kid.current_minutes
-            
-            # First, try to deduct from main time
-            if kid.current_minutes > 0:
-                kid.current_minutes = max(-5, round(kid.current_minutes - total_elapsed_minutes, 1))
-                
-                # If main time went negative and bonus is enabled, use bonus time for the remainder
-                if bonus_time_enabled and kid.current_minutes < 0:
-                    remaining_to_deduct = abs(kid.current_minutes)  # How much more to deduct
-                    kid.daily_bonus_used = min(15, round(kid.daily_bonus_used + remaining_to_deduct, 1))
-                    kid.current_minutes = -5  # Cap at -5
-            elif bonus_time_enabled and kid.daily_bonus_used < 15:
-                # If main time was already exhausted, deduct from bonus time
-                kid.daily_bonus_used = min(15, round(kid.daily_bonus_used + total_elapsed_minutes, 1))
-            
-            # Calculate the actual time change for the log entry
-            # Since we're deducting time, the change should be negative
-            actual_time_change = -total_elapsed_minutes
-            
-            # Create a log entry for the time deduction (points not affected)
-            log_entry = LogEntry(
-                kid_id=kid_id,
-                time_change=actual_time_change,  # Negative value since time was deducted
-                points_change=0,  # Points are not affected during time expiration
-                reason="Time expired - session ended"
-            )
-            session.add(log_entry)
-            session.add(kid)
-            session.commit()
-    
-    # Lock the screen when time expires
-    lock_screen()
-    
-    # Reset all session tracking
-    app.state.active_kid_id = None
-    app.state.session_start_time = None
-    app.state.time_remaining_at_start = 0
-    app.state.original_time_at_session_start = 0
+    # Settle the device's session (or the latest one)
+    # Nothing left to settle if e.g. the server's deadline timer got there first, and it locked the screen then
+    snapshot = app.state.sessions.find(device=device)
+    if snapshot:
+        expire_session(snapshot)
     
     return {"message": "Time expired and screen locked"}
 
 
-@app.get("/api/logs")
-def get_logs_api(request: Request, session: Session = Depends(get_session)):
-    # Check if admin is authenticated by checking session cookie
-    if not request.session.get("admin_authenticated"):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    # Get all log entries, ordered by timestamp (newest first)
-    logs = session.exec(select(LogEntry).order_by(LogEntry.timestamp.desc())).all()
+@app.post("/api/usage/batch", dependencies=[Depends(device_required)])
+def usage_batch(events: List[UsageEvent], device: str = DEFAULT_DEVICE):
+    """Reconcile what a locker enforced while it couldn't reach the server.
+
+    Sessions the locker ended locally but the server still has open are settled
+    together in one transaction. Uploading the same events again is harmless:
+    a session is only ever settled once.
+    """
+    # Lockers don't have an admin session, so they send the device token instead,
+    # and a session is only settled by an event from the device it runs on
+    results, expired = [], []
+    for usage in events:
+        snapshot = app.state.sessions.get(usage.session_id)
+        if usage.event != "expired":
+            results.append({"session_id": usage.session_id, "status": "ignored"})
+        elif snapshot and snapshot.device == device and claim_session(snapshot):
+            # Reaching the deadline means the session ran its full length
+            expired.append((snapshot, snapshot.duration_seconds))
+            results.append({"session_id": usage.session_id, "status": "settled"})
+        else:
+            # The server ended it already (its own deadline timer, a stop or a restart)
+            results.append({"session_id": usage.session_id, "status": "already_settled"})
+    
+    if expired:
+        settle_sessions(expired, "Time expired on the device while the server was unreachable", "expire")
+        for snapshot, _ in expired:
+            broker.publish("session_expired", session_ended_payload(snapshot))
+    return {"results": results}
+
+
+def device_line(device: str) -> str:
+    """The device's session as one line: state, server time, deadline (both epoch seconds), kid id, name"""
+    now = time.time()
+    snapshot = app.state.sessions.for_device(device)
+    if not snapshot:
+        return f"0 {int(now)} 0 0 \n"
+    deadline = now + snapshot.remaining_seconds()
+    return f"1 {int(now)} {int(deadline)} {snapshot.kid_id} {snapshot.kid_name}\n"
+
+@app.get("/api/device/{device}", response_class=PlainTextResponse)
+async def device_status(device: str, request: Request):
+    # For small displays like the ESP32: a fixed-layout text line instead of JSON.
+    # The device counts down to the deadline by itself (deadline - server time gives the
+    # remaining seconds without a synced clock) and only polls to notice starts and stops,
+    # which If-None-Match turns into empty 304s.
+    return await conditional_response(request, lambda: device_line(device), PlainTextResponse)
+
+
+def encode_log_cursor(timestamp: datetime, row_id: int) -> str:
+    return f"{timestamp.isoformat()},{row_id}"
+
+def decode_log_cursor(cursor: str):
+    try:
+        timestamp, log_id = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def filter_logs(query, model, kid_id: Optional[int], since: Optional[date], until: Optional[date], reason: Optional[str]):
+    """Apply the optional log filters to a query over LogEntry or LogSummary: kid, date range (inclusive) and reason prefix"""
+    if kid_id is not None:
+        query = query.where(model.kid_id == kid_id)
+    if since:
+        query = query.where(model.timestamp >= datetime.combine(since, datetime.min.time()))
+    if until:
+        query = query.where(model.timestamp < datetime.combine(until + timedelta(days=1), datetime.min.time()))
+    if reason:
+        query = query.where(model.reason.startswith(reason, autoescape=True))
+    return query
+
+def log_page_query(model, row_id, limit: int, cursor, kid_id: Optional[int], since: Optional[date], until: Optional[date], reason: Optional[str]):
+    """The filtered page query for LogEntry or LogSummary rows, newest first"""
+    # One query for the page, joining the kid's name instead of looking it up per row
+    query = select(model, row_id.label("row_id"), Kid.name).outerjoin(Kid, Kid.id == model.kid_id)
+    query = filter_logs(query, model, kid_id, since, until, reason)
+    
+    # Keyset pagination: continue after the (timestamp, id) of the last row of the previous page
+    if cursor:
+        cursor_timestamp, cursor_id = cursor
+        query = query.where(or_(
+            model.timestamp < cursor_timestamp,
+            and_(model.timestamp == cursor_timestamp, row_id < cursor_id)
+        ))
+    
+    # Fetch one extra row to know whether there is another page
+    return query.order_by(model.timestamp.desc(), row_id.desc()).limit(limit + 1)
+
+def query_logs(session: Session, limit: int, cursor, kid_id: Optional[int], since: Optional[date], until: Optional[date], reason: Optional[str]):
+    """One page of the activity log, newest first; cursor is a decoded (timestamp, id) or None.
+
+    Archived days appear as one summary row per kid, with a negative id.
+    """
+    filters = (limit, cursor, kid_id, since, until, reason)
+    rows = session.exec(log_page_query(LogEntry, LogEntry.id, *filters)).all()
+    rows += session.exec(log_page_query(LogSummary, -LogSummary.id, *filters)).all()
+    rows.sort(key=lambda row: (row[0].timestamp, row[1]), reverse=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
     # Convert logs to JSON-serializable format
     logs_data = []
-    for log in logs:
-        # Find the kid's name using a separate query
-        kid = session.get(Kid, log.kid_id)
-        kid_name = kid.name if kid else "Unknown"
-        
+    for log, row_id, kid_name in rows:
         logs_data.append({
-            "id": log.id,
-            "kid_name": kid_name,
-            "time_change": log.time_change,
+            "id": row_id,
+            "kid_id": log.kid_id,
+            "kid_name": kid_name or "Unknown",
+            "time_change": accounting.display_minutes(log.time_change),
             "points_change": log.points_change,
             "reason": log.reason,
             "timestamp": log.timestamp.isoformat()
         })
     
-    return {"logs": logs_data}
+    next_cursor = encode_log_cursor(rows[-1][0].timestamp, rows[-1][1]) if has_more else None
+    return {"logs": logs_data, "next_cursor": next_cursor}
+
+@app.get("/api/analytics", dependencies=[Depends(admin_required)])
+async def get_analytics(
+    request: Request,
+    kid_id: Optional[int] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    bucket: str = "day"
+):
+    if bucket not in analytics.BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Unknown bucket, use one of: {', '.join(analytics.BUCKETS)}")
+    
+    # The last 30 days by default
+    until = until or date.today()
+    since = since or until - timedelta(days=29)
+    if since > until or (until - since).days > analytics.MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"since must be before until, at most {analytics.MAX_RANGE_DAYS} days apart")
+    
+    return await conditional_response(request, lambda: run_query(analytics.usage_report, kid_id, since, until, bucket))
+
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+EXPORT_COLUMNS = ["id", "kid_id", "kid_name", "time_change", "points_change", "reason", "timestamp"]
+EXPORT_BATCH_ROWS = 1000  # Rows per chunk sent to the client, and fetched from SQLite at a time
+
+def export_log_query(model, row_id, kid_id: Optional[int], since: Optional[date], until: Optional[date], reason: Optional[str]):
+    # Plain columns instead of ORM objects: nothing piles up in the session's identity map
+    query = select(
+        row_id, model.kid_id, Kid.name, model.time_change, model.points_change, model.reason, model.timestamp
+    ).outerjoin(Kid, Kid.id == model.kid_id)
+    query = filter_logs(query, model, kid_id, since, until, reason)
+    return query.order_by(model.timestamp, row_id).execution_options(yield_per=EXPORT_BATCH_ROWS)
+
+def iter_log_export(export_format: str, kid_id: Optional[int], since: Optional[date], until: Optional[date], reason: Optional[str]):
+    """Yield the activity log, oldest first, as CSV or JSONL chunks of EXPORT_BATCH_ROWS rows.
+
+    Rows are streamed from a database cursor, so memory stays flat however long
+    the log is. Archived days come first as their summary rows (negative ids),
+    like in /api/logs.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+    
+    # The request's session is closed before the body is sent, so the stream has its own
+    with Session(engine) as session:
+        for model, row_id in ((LogSummary, -LogSummary.id), (LogEntry, LogEntry.id)):
+            for count, row in enumerate(session.exec(export_log_query(model, row_id, kid_id, since, until, reason)), 1):
+                values = list(row)
+                values[-1] = values[-1].isoformat()
+                if export_format == "csv":
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values))) + "\n")
+                if count % EXPORT_BATCH_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+    yield buffer.getvalue()
+
+@app.get("/admin/export_logs", dependencies=[Depends(admin_required)])
+def export_logs(
+    format: str = "csv",
+    kid_id: Optional[int] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    reason: Optional[str] = None
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format, use one of: {', '.join(EXPORT_FORMATS)}")
+    
+    filename = f"familytime-logs-{date.today():%Y%m%d}.{format}"
+    return StreamingResponse(
+        iter_log_export(format, kid_id, since, until, reason),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/api/logs", dependencies=[Depends(admin_required)])
+async def get_logs_api(
+    request: Request,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    kid_id: Optional[int] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    reason: Optional[str] = None
+):
+    limit = max(1, min(limit, 500))
+    decoded_cursor = decode_log_cursor(cursor) if cursor else None
+    return await conditional_response(request, lambda: run_query(query_logs, limit, decoded_cursor, kid_id, since, until, reason))
 
 if __name__ == "__main__":
     import uvicorn
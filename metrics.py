@@ -0,0 +1,232 @@
+"""Per-request metrics: latency, SQL queries and database time per route.
+
+MetricsMiddleware times every HTTP request and keeps its RequestStats in a
+contextvar. The SQLAlchemy cursor events of an instrumented engine add each
+query to the stats of the request that ran it, including from threadpool
+workers, which run with a copy of the request's context. Totals per route are
+rendered in the Prometheus text format for /metrics.
+
+METRICS_SLOW_REQUEST_MS logs requests slower than that (0 turns it off).
+Requests that are held open on purpose, event streams (text/event-stream)
+and the long-poll routes in METRICS_UNTIMED_ROUTES, are counted but left out
+of the latency histogram and the slow log: their duration is how long the
+client waited, not how long the server worked.
+With PROFILE_REQUESTS=1, a request sent with the header "X-Profile: 1" runs
+under cProfile and the stats are written to PROFILE_DIR (open them with
+pstats or snakeviz). cProfile only sees the thread it runs in: the capture
+covers the event loop and run_query's workers (see profile_thread), not the
+threadpool that runs sync endpoints. Everything else on the event loop at the
+same time ends up in the capture too, so profile on a quiet server.
+"""
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+METRICS_SLOW_REQUEST_MS = float(os.getenv("METRICS_SLOW_REQUEST_MS", 500))
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+METRICS_UNTIMED_ROUTES = {route for route in os.getenv("METRICS_UNTIMED_ROUTES", "/api/session/wait").split(",") if route}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+UNMATCHED_ROUTE = "(unmatched)"  # 404s, so random paths don't each become a label
+
+
+class RequestStats:
+    """What one request did, filled in by the SQLAlchemy events while it runs"""
+
+    __slots__ = ("queries", "db_seconds", "profilers")
+
+    def __init__(self, profile: bool = False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.profilers: Optional[List[cProfile.Profile]] = [] if profile else None
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # Per bucket, made cumulative when rendered
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class RouteStats:
+    def __init__(self):
+        self.statuses: Dict[int, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+
+
+class Metrics:
+    """Totals per (method, route), safe to update from any thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: Optional[float], stats: RequestStats):
+        """Record a request; seconds is None for the ones that aren't timed (streams and long polls)"""
+        with self.lock:
+            route_stats = self.routes.get((method, route))
+            if route_stats is None:
+                route_stats = self.routes[(method, route)] = RouteStats()
+            route_stats.statuses[status] = route_stats.statuses.get(status, 0) + 1
+            if seconds is not None:
+                route_stats.latency.observe(seconds)
+            route_stats.queries.observe(stats.queries)
+            route_stats.db_seconds += stats.db_seconds
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            routes = sorted(self.routes.items())
+            lines = [
+                "# HELP familytime_requests_total HTTP requests by route and status.",
+                "# TYPE familytime_requests_total counter",
+            ]
+            for (method, route), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f"familytime_requests_total{labels(method=method, route=route, status=status)} {count}")
+            for name, help_text, attribute in (
+                ("familytime_request_duration_seconds", "Time from request to the last byte of the response.", "latency"),
+                ("familytime_db_queries_per_request", "SQL statements run per request.", "queries"),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (method, route), stats in routes:
+                    histogram = getattr(stats, attribute)
+                    if not histogram.count:
+                        continue  # A route whose requests are all untimed
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{labels(method=method, route=route, le=bound)} {cumulative}")
+                    lines.append(f"{name}_bucket{labels(method=method, route=route, le='+Inf')} {histogram.count}")
+                    lines.append(f"{name}_sum{labels(method=method, route=route)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{labels(method=method, route=route)} {histogram.count}")
+            lines += [
+                "# HELP familytime_db_seconds_total Time spent executing SQL, by route.",
+                "# TYPE familytime_db_seconds_total counter",
+            ]
+            for (method, route), stats in routes:
+                lines.append(f"familytime_db_seconds_total{labels(method=method, route=route)} {stats.db_seconds:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+def labels(**values) -> str:
+    escaped = (f'{name}="{escape_label(value)}"' for name, value in values.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def instrument_engine(engine):
+    """Count the queries and database time of every statement run on engine against the current request"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+
+@contextmanager
+def profile_thread():
+    """Add this thread's work to the current request's profile, if it is being profiled"""
+    stats = current_request.get()
+    if stats is None or stats.profilers is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    stats.profilers.append(profiler)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+def save_profile(stats: RequestStats, method: str, route: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    path = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{method}-{name}.prof")
+    combined = pstats.Stats(stats.profilers[0])
+    for profiler in stats.profilers[1:]:
+        combined.add(profiler)
+    combined.dump_stats(path)
+    return path
+
+
+class MetricsMiddleware:
+    """Time every HTTP request and record it, with its SQL statements, under its route"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = PROFILE_REQUESTS and (b"x-profile", b"1") in scope["headers"]
+        stats = RequestStats(profile=profile)
+        token = current_request.set(stats)
+        status = 500  # If the app fails before starting a response
+        streaming = False
+
+        async def send_and_record_status(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = any(
+                    name.lower() == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        start = time.perf_counter()
+        with profile_thread():
+            try:
+                await self.app(scope, receive, send_and_record_status)
+            finally:
+                seconds = time.perf_counter() - start
+                current_request.reset(token)
+
+                # FastAPI puts the matched route into the scope
+                route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+                timed = not streaming and route not in METRICS_UNTIMED_ROUTES
+                self.metrics.observe(scope["method"], route, status, seconds if timed else None, stats)
+                if timed and METRICS_SLOW_REQUEST_MS and seconds * 1000 >= METRICS_SLOW_REQUEST_MS:
+                    print(f"Slow request: {scope['method']} {scope['path']} -> {status} in {seconds * 1000:.0f} ms, "
+                          f"{stats.queries} queries ({stats.db_seconds * 1000:.0f} ms in the database)")
+        if profile:
+            print(f"Profile of {scope['method']} {scope['path']} saved to {save_profile(stats, scope['method'], route)}")
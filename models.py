@@ -1,46 +1,94 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index
 from datetime import datetime
 from typing import Optional
 import hashlib
-from datetime import date
 
 
 class Kid(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
-    current_minutes: int = Field(default=0)  # Min: -5
-    daily_bonus_used: int = Field(default=0)  # Max: 15 per day
-    last_reset_date: str = Field(default="")  # Format: "YYYY-MM-DD"
-    
-    def reset_daily_bonus_if_needed(self):
-        """Reset daily bonus if the last reset date is not today"""
-        today = str(date.today())
-        if self.last_reset_date != today:
-            self.daily_bonus_used = 0
-            self.last_reset_date = today
-    
-    def deduct_time(self, seconds_to_deduct: int = 10):
-        """Deduct time from kid's balance, using main time first, then daily bonus if needed"""
-        minutes_to_deduct = seconds_to_deduct / 60
-        
-        # First, try to deduct from main time if available
-        if self.current_minutes > 0:
-            self.current_minutes = max(-5, self.current_minutes - minutes_to_deduct)
-        else:
-            # If main time is exhausted, deduct from daily bonus
-            self.daily_bonus_used = min(15, self.daily_bonus_used + minutes_to_deduct)
+    current_minutes: float = Field(default=0)  # Min: -5, stored to the second (see accounting.py)
+    daily_bonus_used: float = Field(default=0)  # Max: 15 per day
+    last_reset_date: str = Field(default="")  # Format: "YYYY-MM-DD", the daily bonus is reset by main.daily_rollover
 
 
 class LogEntry(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_logentry_kid_id_timestamp", "kid_id", "timestamp"),  # Per-kid history
+        Index("ix_logentry_timestamp_id", "timestamp", "id"),  # Keyset pagination of /api/logs
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     kid_id: int
-    time_change: int  # Change in time (for PC usage) - Positive = reward, negative = penalty
+    time_change: float  # Change in time (for PC usage) - Positive = reward, negative = penalty
     points_change: int  # Change in points (for leaderboard) - Positive = reward, negative = penalty
     reason: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 
+class LogSummary(SQLModel, table=True):
+    """Per-kid, per-day totals of archived LogEntry rows (the rows themselves go to an archive file, see archive.py)"""
+    __table_args__ = (
+        Index("ix_logsummary_kid_id_timestamp", "kid_id", "timestamp", unique=True),
+        Index("ix_logsummary_timestamp_id", "timestamp", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kid_id: int
+    timestamp: datetime  # Start of the day
+    time_change: float = Field(default=0)
+    points_change: int = Field(default=0)
+    entries: int = Field(default=0)  # How many log entries were rolled up
+    reason: str = Field(default="")
+
+
+class UsageDaily(SQLModel, table=True):
+    """Per-kid, per-day totals for the usage analytics, added to with every logged change (see analytics.py)"""
+    kid_id: int = Field(primary_key=True)
+    day: str = Field(primary_key=True)  # Format: "YYYY-MM-DD", local date like Kid.last_reset_date
+    usage_seconds: int = Field(default=0)  # Session time charged
+    bonus_seconds: int = Field(default=0)  # The part of it that came from the daily bonus
+    sessions: int = Field(default=0)
+    time_added: float = Field(default=0)  # Net manual time changes, in minutes
+    points_change: int = Field(default=0)
+
+
+class KidPoints(SQLModel, table=True):
+    """Leaderboard points per kid, kept in sync with the LogEntry points_change sum"""
+    kid_id: Optional[int] = Field(default=None, primary_key=True)
+    points: int = Field(default=0)
+
+
 class AdminConfig(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    admin_password: str = Field(default="admin")  # Default password
-    bonus_time_enabled: bool = Field(default=True)  # Whether bonus time is enabled
\ No newline at end of file
+    admin_password: str = Field(default="admin")  # bcrypt hash (see auth.py); plain text from older versions is hashed at startup
+    bonus_time_enabled: bool = Field(default=True)  # Whether bonus time is enabled
+
+
+class SessionEvent(SQLModel, table=True):
+    """Append-only journal of session starts and ends, replayed at startup to recover running sessions"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: str = Field(index=True)
+    event: str  # "start", "stop", "expire" or "cancel"
+    kid_id: int
+    device: str
+    duration_seconds: float = Field(default=0)  # Time granted for the session
+    original_minutes: float = Field(default=0)  # Kid's main time at session start
+    bonus_time_enabled: bool = Field(default=True)
+    offset_seconds: float = Field(default=0)  # Monotonic seconds since the session started
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+
+class UsageEvent(SQLModel):
+    """A session end a locker saw on its own, uploaded in a batch once it reaches the server again"""
+    session_id: str
+    event: str = "expired"  # The locker locked the PC at the session's deadline
+    at: Optional[float] = None  # Epoch seconds on the device
+
+
+class Adjustment(SQLModel):
+    """One row of a bulk time/points adjustment, like a single /admin/time or /admin/points form post"""
+    kid_id: Optional[int] = None  # None applies the row to every kid
+    kind: str = "time"  # "time" also adds the same amount of points, like /admin/time; "points" only changes points
+    amount: int
+    reason: str
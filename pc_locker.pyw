@@ -2,11 +2,34 @@ import time
 import requests
 import os
 import sys
+import json
+import threading
 from datetime import datetime
 
 # Configuration
-API_URL = "http://127.0.0.1:8000/api/session/status"
-CHECK_INTERVAL = 10  # seconds
+SERVER_URL = "http://127.0.0.1:8000"
+DEVICE_ID = "default"  # Name of this PC, used when the admin starts a session on it
+WAIT_URL = f"{SERVER_URL}/api/session/wait"
+USAGE_URL = f"{SERVER_URL}/api/usage/batch"
+# Must match the server's DEVICE_TOKEN (not needed when the locker runs on the server itself)
+DEVICE_TOKEN = os.getenv("DEVICE_TOKEN", "")
+WAIT_TIMEOUT = 30  # seconds the server holds a long poll open when nothing changes
+RETRY_INTERVAL = 5  # seconds between attempts while the server is unreachable
+# The last known session and the not yet uploaded usage events survive restarts of the locker
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pc_locker_state.json")
+
+# One keep-alive connection for all long polls
+http = requests.Session()
+
+# Locks the workstation when the current session's time runs out
+deadline_timer = None
+
+# ETag of the last long-poll answer (names the device's session) and whether it was active
+last_state = {"etag": None, "is_active": False}
+
+# Cached session (its deadline in epoch seconds), usage events waiting for upload and those the server rejected
+offline_state = {"session": None, "pending_events": [], "rejected_events": []}
+state_lock = threading.RLock()  # Re-entrant, so changes and the save_state() after them are one step
 
 def log_message(message):
     """Log message with timestamp"""
@@ -20,31 +43,143 @@ def lock_workstation():
     except Exception as e:
         log_message(f"Error locking workstation: {e}")
 
+def load_state():
+    """Read the cached session and pending events written by a previous run"""
+    try:
+        with open(STATE_FILE) as f:
+            offline_state.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+def save_state():
+    # Write a temporary file first, so a crash never leaves a half-written cache
+    with state_lock:
+        temp_file = STATE_FILE + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(offline_state, f)
+        os.replace(temp_file, STATE_FILE)
+
+def schedule_deadline(seconds_remaining):
+    """Lock the workstation after seconds_remaining (None cancels the pending lock)"""
+    global deadline_timer
+    if deadline_timer:
+        deadline_timer.cancel()
+        deadline_timer = None
+    if seconds_remaining is None:
+        return
+    if seconds_remaining <= 0:
+        log_message("Time exhausted, locking workstation...")
+        lock_workstation()
+        return
+    deadline_timer = threading.Timer(seconds_remaining, session_deadline_reached)
+    deadline_timer.daemon = True
+    deadline_timer.start()
+
+def session_deadline_reached():
+    """Lock at the cached deadline, and record it for the server in case it can't be reached"""
+    schedule_deadline(0)
+    # The timer thread and the main loop's upload both change the pending events
+    with state_lock:
+        session = offline_state["session"]
+        if not session:
+            return
+        offline_state["pending_events"].append({"session_id": session["session_id"], "event": "expired", "at": time.time()})
+        offline_state["session"] = None
+        save_state()
+    try:
+        upload_usage()
+    except requests.exceptions.RequestException as e:
+        log_message(f"Server unreachable, usage queued for later: {e}")
+
+def enforce_cached_deadline():
+    """Start the lock timer from the cached session, e.g. when the locker starts while the server is down"""
+    session = offline_state["session"]
+    if session:
+        seconds_remaining = session["deadline"] - time.time()
+        log_message(f"Enforcing cached session {session['session_id']}, {max(0, int(seconds_remaining))} seconds left")
+        if seconds_remaining <= 0:
+            session_deadline_reached()
+        else:
+            schedule_deadline(seconds_remaining)
+
+def upload_usage():
+    """Send the queued usage events to the server in one batch"""
+    with state_lock:
+        events = list(offline_state["pending_events"])
+    if not events:
+        return
+    response = http.post(
+        USAGE_URL, params={"device": DEVICE_ID}, json=events, headers={"X-Device-Token": DEVICE_TOKEN}, timeout=10
+    )
+    # Sending the same events again won't help with e.g. a wrong DEVICE_TOKEN, so they are parked in the state file
+    rejected = 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+    if rejected:
+        log_message(f"Server rejected {len(events)} usage events ({response.status_code}), parked them: {response.text}")
+    else:
+        response.raise_for_status()
+        for result in response.json()["results"]:
+            log_message(f"Reconciled session {result['session_id']}: {result['status']}")
+    with state_lock:
+        if rejected:
+            offline_state["rejected_events"].extend(events)
+        # Events queued during the upload stay for the next one
+        offline_state["pending_events"] = offline_state["pending_events"][len(events):]
+        save_state()
+
+def wait_for_change():
+    """Long-poll the server until this PC's session starts, stops or expires (or WAIT_TIMEOUT passes)"""
+    headers = {"If-None-Match": last_state["etag"]} if last_state["etag"] else {}
+    response = http.get(
+        WAIT_URL, params={"device": DEVICE_ID, "timeout": WAIT_TIMEOUT}, headers=headers,
+        timeout=(5, WAIT_TIMEOUT + 15)
+    )
+    if response.status_code == 304:
+        return  # Nothing changed
+    response.raise_for_status()
+
+    data = response.json()
+    last_state["etag"] = response.headers.get("ETag")
+    if data.get("is_active"):
+        seconds_remaining = data["time_remaining_seconds"]
+        log_message(f"Session active for {data['kid_name']}, {int(seconds_remaining)} seconds left")
+        # Cache the deadline, so it is still enforced if the server goes away or the locker restarts
+        with state_lock:
+            offline_state["session"] = {"session_id": data["session_id"], "kid_id": data["kid_id"], "deadline": time.time() + seconds_remaining}
+            save_state()
+        # The local timer locks right at the deadline, without waiting for the server
+        schedule_deadline(seconds_remaining)
+    else:
+        if last_state["is_active"] or offline_state["session"]:
+            log_message("Session ended, locking workstation...")
+            schedule_deadline(None)
+            lock_workstation()
+        else:
+            schedule_deadline(None)
+        with state_lock:
+            offline_state["session"] = None
+            save_state()
+    last_state["is_active"] = bool(data.get("is_active"))
+
 def main():
     log_message("PC Locker started")
-    
+    load_state()
+    enforce_cached_deadline()
+
     while True:
         try:
-            # Get session status from the API
-            response = requests.get(API_URL, timeout=5)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data.get("is_active") and data.get("time_remaining_seconds", 0) <= 0:
-                    log_message("Time exhausted, locking workstation...")
-                    lock_workstation()
-                    
-            elif response.status_code == 404:
-                log_message("No active session or server not responding")
-            
+            # Reconcile what happened while the server was unreachable first
+            upload_usage()
+        except Exception as e:
+            # Still poll: the events stay queued for the next round
+            log_message(f"Error uploading usage: {e}")
+        try:
+            wait_for_change()
         except requests.exceptions.RequestException as e:
             log_message(f"Error connecting to server: {e}")
+            time.sleep(RETRY_INTERVAL)
         except Exception as e:
             log_message(f"Unexpected error: {e}")
-        
-        # Wait before next check
-        time.sleep(CHECK_INTERVAL)
+            time.sleep(RETRY_INTERVAL)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
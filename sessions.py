@@ -0,0 +1,173 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, Iterator, List, Optional
+
+DEFAULT_DEVICE = "default"
+# The device that is the server machine itself: only its sessions lock the server's screen
+LOCAL_DEVICE = os.getenv("LOCAL_DEVICE", DEFAULT_DEVICE)
+SCHEDULER_RETRY_SECONDS = float(os.getenv("SCHEDULER_RETRY_SECONDS", 30))  # Until a failed callback goes through
+
+
+class SessionSnapshot:
+    """Everything the status endpoints need about a running session, captured when it starts.
+
+    Remaining time is pure arithmetic on the monotonic clock, so polling the
+    status never has to touch the database.
+    """
+
+    __slots__ = ("session_id", "device", "kid_id", "kid_name", "duration_seconds", "original_minutes", "bonus_time_enabled", "started_at")
+
+    def __init__(self, kid_id: int, kid_name: str, duration_seconds: float, original_minutes: float, bonus_time_enabled: bool,
+                 device: str = DEFAULT_DEVICE, session_id: Optional[str] = None, elapsed_seconds: float = 0):
+        self.session_id = session_id or uuid.uuid4().hex[:16]  # Unique across restarts (see the session journal)
+        self.device = device
+        self.kid_id = kid_id
+        self.kid_name = kid_name
+        self.duration_seconds = duration_seconds  # Time granted for this session
+        self.original_minutes = original_minutes  # Kid's main time at session start, for the deduction
+        self.bonus_time_enabled = bonus_time_enabled
+        self.started_at = time.monotonic() - elapsed_seconds  # Sessions restored after a restart already ran a while
+
+    @property
+    def deadline(self) -> float:
+        """Monotonic time at which the session's time runs out"""
+        return self.started_at + self.duration_seconds
+
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining_seconds(self) -> float:
+        return max(0, self.duration_seconds - self.elapsed_seconds())
+
+
+class SessionRegistry:
+    """The running sessions, indexed by session id, kid and device.
+
+    A kid plays on one device at a time and a device shows one kid at a time,
+    so every lookup is a single dict access.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_id: Dict[str, SessionSnapshot] = {}  # In start order
+        self.by_kid: Dict[int, SessionSnapshot] = {}
+        self.by_device: Dict[str, SessionSnapshot] = {}
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[SessionSnapshot]:
+        with self.lock:
+            return iter(list(self.by_id.values()))
+
+    def get(self, session_id: str) -> Optional[SessionSnapshot]:
+        return self.by_id.get(session_id)
+
+    def for_kid(self, kid_id: int) -> Optional[SessionSnapshot]:
+        return self.by_kid.get(kid_id)
+
+    def for_device(self, device: str) -> Optional[SessionSnapshot]:
+        return self.by_device.get(device)
+
+    def latest(self) -> Optional[SessionSnapshot]:
+        """The most recently started session"""
+        with self.lock:
+            return next(reversed(self.by_id.values()), None)
+
+    def find(self, session_id: Optional[str] = None, kid_id: Optional[int] = None, device: Optional[str] = None) -> Optional[SessionSnapshot]:
+        """Look a session up by whichever key is given, or return the latest one"""
+        if session_id:
+            return self.get(session_id)
+        if kid_id is not None:
+            return self.for_kid(kid_id)
+        if device:
+            return self.for_device(device)
+        return self.latest()
+
+    def add(self, snapshot: SessionSnapshot) -> List[SessionSnapshot]:
+        """Register a session and return the ones it displaced (same kid or same device)"""
+        with self.lock:
+            displaced = []
+            for existing in (self.by_kid.get(snapshot.kid_id), self.by_device.get(snapshot.device)):
+                if existing and existing not in displaced:
+                    self._remove(existing)
+                    displaced.append(existing)
+            self.by_id[snapshot.session_id] = snapshot
+            self.by_kid[snapshot.kid_id] = snapshot
+            self.by_device[snapshot.device] = snapshot
+            return displaced
+
+    def remove(self, snapshot: SessionSnapshot) -> bool:
+        """Unregister a session; False if it was already gone"""
+        with self.lock:
+            if self.by_id.get(snapshot.session_id) is not snapshot:
+                return False
+            self._remove(snapshot)
+            return True
+
+    def _remove(self, snapshot: SessionSnapshot):
+        del self.by_id[snapshot.session_id]
+        del self.by_kid[snapshot.kid_id]
+        del self.by_device[snapshot.device]
+
+
+class DeadlineScheduler:
+    """Runs callbacks at time.monotonic() deadlines on the event loop's timer.
+
+    Each deadline has a key (the session id); scheduling a key again replaces its
+    deadline. Callbacks run in the default executor because they talk to the database.
+    A callback that raises is logged and retried every SCHEDULER_RETRY_SECONDS.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.handles: Dict[str, asyncio.TimerHandle] = {}
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def schedule(self, key: str, deadline: float, callback: Callable, *args, retry: Optional[Callable] = None):
+        """Run callback(*args) at the monotonic time `deadline` (safe to call from any thread).
+
+        If it raises, retry(*args) runs instead on the next attempts (the callback itself by default).
+        """
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._schedule, key, deadline, callback, args, retry or callback)
+
+    def cancel(self, key: str):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._cancel, key)
+
+    def _schedule(self, key: str, deadline: float, callback: Callable, args: tuple, retry: Callable):
+        self._cancel(key)
+        # The loop's clock isn't guaranteed to be time.monotonic() (e.g. uvloop), so use a delay
+        delay = max(0, deadline - time.monotonic())
+        self.handles[key] = self.loop.call_later(delay, self._fire, key, callback, args, retry)
+
+    def _cancel(self, key: str):
+        handle = self.handles.pop(key, None)
+        if handle:
+            handle.cancel()
+
+    def _fire(self, key: str, callback: Callable, args: tuple, retry: Callable):
+        self.handles.pop(key, None)
+        future = self.loop.run_in_executor(None, callback, *args)
+        future.add_done_callback(functools.partial(self._done, key, args, retry))
+
+    def _done(self, key: str, args: tuple, retry: Callable, future: asyncio.Future):
+        # Runs on the loop once the callback finished; an exception would otherwise go unseen
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        print(f"Scheduled job {key} failed, retrying in {SCHEDULER_RETRY_SECONDS:g} s: {error!r}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+        if key in self.handles:
+            return  # Scheduled again in the meantime, and that run takes over
+        self._schedule(key, time.monotonic() + SCHEDULER_RETRY_SECONDS, retry, args, retry)
@@ -0,0 +1,169 @@
+"""Database engine for FamilyTime, tuned for SQLite.
+
+Sync endpoints run in Starlette's threadpool, so the admin UI, the kids page,
+the PC locker and the ESP32 all hit the database from different threads at once.
+WAL lets readers carry on while one writer commits, and busy_timeout makes a
+second writer wait for the lock instead of failing with "database is locked".
+
+Every setting can be overridden with an environment variable of the same name.
+With DB_ASYNC=1 the hot read endpoints query through SQLAlchemy's asyncio
+extension over aiosqlite instead of taking a threadpool slot (see run_query).
+The single admin config row is read once and kept in admin_config_cache.
+"""
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import bindparam, event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine, select
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from models import AdminConfig, Kid
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./familiytime.db")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # Safe with WAL, only the last commits can be lost on power failure
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 64 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", 256))  # Prepared statements kept per connection
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 16))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_ASYNC = os.getenv("DB_ASYNC", "0").lower() in ("1", "true", "yes")
+
+
+def make_engine(url: str = DATABASE_URL):
+    """Create an engine with pooled connections and the SQLite pragmas applied to each one"""
+    if not url.startswith("sqlite"):
+        return create_engine(url, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+
+    connect_args = {
+        "check_same_thread": False,  # Pooled connections move between threadpool workers
+        "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+        "cached_statements": SQLITE_CACHED_STATEMENTS,
+    }
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        # An in-memory database only exists on its one connection
+        engine = create_engine(url, echo=False, connect_args=connect_args, poolclass=StaticPool)
+    else:
+        engine = create_engine(
+            url, echo=False, connect_args=connect_args,
+            pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT
+        )
+    apply_sqlite_pragmas(engine)
+    return engine
+
+
+def make_async_engine(url: str = DATABASE_URL):
+    """Create an asyncio engine on the same database, over aiosqlite for SQLite"""
+    from sqlalchemy.ext.asyncio import create_async_engine  # Only needed (and aiosqlite installed) with DB_ASYNC
+
+    if not url.startswith("sqlite"):
+        return create_async_engine(url, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+
+    # aiosqlite hands these on to sqlite3.connect
+    connect_args = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000, "cached_statements": SQLITE_CACHED_STATEMENTS}
+    engine = create_async_engine(
+        url.replace("sqlite://", "sqlite+aiosqlite://", 1), echo=False, connect_args=connect_args,
+        pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT
+    )
+    apply_sqlite_pragmas(engine.sync_engine)
+    return engine
+
+
+def apply_sqlite_pragmas(engine):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+
+engine = make_engine()
+async_engine = make_async_engine() if DB_ASYNC else None
+
+
+async def run_query(function, *args):
+    """Run function(session, *args) without blocking the event loop and return its result.
+
+    The function is plain sync SQLModel code, so the same query serves both modes:
+    with DB_ASYNC it runs on an AsyncSession (aiosqlite does the I/O), otherwise
+    on a Session in Starlette's threadpool. Return plain data, not ORM objects.
+    """
+    if async_engine is not None:
+        from sqlmodel.ext.asyncio.session import AsyncSession
+
+        async with AsyncSession(async_engine) as session:
+            return await session.run_sync(function, *args)
+    return await run_in_threadpool(_run_in_session, function, *args)
+
+
+def _run_in_session(function, *args):
+    with metrics.profile_thread(), Session(engine) as session:
+        return function(session, *args)
+
+
+# Hot lookups, built once: constructing a select on every request costs about as much as running it
+KID_BY_ID = select(Kid).where(Kid.id == bindparam("kid_id"))
+ADMIN_CONFIG = select(AdminConfig).where(AdminConfig.id == 1)  # There is a single admin config record
+
+
+def get_kid(session: Session, kid_id: int):
+    return session.exec(KID_BY_ID, params={"kid_id": kid_id}).first()
+
+
+def get_admin_config(session: Session):
+    return session.exec(ADMIN_CONFIG).first()
+
+
+class AdminSettings:
+    """The admin config as plain values, safe to share between threads"""
+
+    __slots__ = ("admin_password", "bonus_time_enabled")
+
+    def __init__(self, admin_config: Optional[AdminConfig]):
+        self.admin_password = admin_config.admin_password if admin_config else None
+        self.bonus_time_enabled = admin_config.bonus_time_enabled if admin_config else True
+
+
+class AdminConfigCache:
+    """The admin config, read once and then served from memory.
+
+    The config only changes at startup and on /admin/toggle_bonus_time, which
+    call update() or invalidate() after committing. A load that raced with one
+    of those is not kept, so the cache never goes back to the old value.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.settings: Optional[AdminSettings] = None
+        self.generation = 0
+
+    def get(self, session: Session) -> AdminSettings:
+        settings = self.settings
+        if settings is not None:
+            return settings
+        generation = self.generation
+        settings = AdminSettings(get_admin_config(session))
+        with self.lock:
+            if generation == self.generation:
+                self.settings = settings
+        return settings
+
+    def update(self, admin_config: Optional[AdminConfig]):
+        with self.lock:
+            self.generation += 1
+            self.settings = AdminSettings(admin_config)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.settings = None
+
+
+admin_config_cache = AdminConfigCache()
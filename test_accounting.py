@@ -0,0 +1,69 @@
+"""Check accounting.deduct() against the float arithmetic it replaced, on random balances"""
+import random
+
+from accounting import DAILY_BONUS_SECONDS, MIN_BALANCE_SECONDS, available_seconds, deduct, deduct_batch, display_minutes, to_minutes, to_seconds
+
+SAMPLES = 100000
+
+
+def legacy_deduct(current_minutes, daily_bonus_used, elapsed_seconds, original_minutes, bonus_enabled):
+    """The float arithmetic settle_session used before this module existed"""
+    original_bonus_available = max(0, 15 - daily_bonus_used) if bonus_enabled else 0
+    total_elapsed = min(elapsed_seconds, (max(0, original_minutes) + original_bonus_available) * 60)
+    total_elapsed_minutes = round(total_elapsed / 60.0, 1)
+    if current_minutes > 0:
+        current_minutes = max(-5, round(current_minutes - total_elapsed_minutes, 1))
+        if bonus_enabled and current_minutes < 0:
+            daily_bonus_used = min(15, round(daily_bonus_used + abs(current_minutes), 1))
+            current_minutes = -5
+    elif bonus_enabled and daily_bonus_used < 15:
+        daily_bonus_used = min(15, round(daily_bonus_used + total_elapsed_minutes, 1))
+    return current_minutes, daily_bonus_used, total_elapsed_minutes
+
+
+def test_deduct_matches_legacy():
+    rng = random.Random(8)
+    columns = ([], [], [], [], [])
+    for _ in range(SAMPLES):
+        minutes = rng.choice([rng.randint(-5, 120), round(rng.uniform(-5, 120), 1)])
+        bonus_used = rng.choice([0, 15, round(rng.uniform(0, 15), 1)])
+        bonus_enabled = rng.random() < 0.7
+        main, used = to_seconds(minutes), to_seconds(bonus_used)
+        allowance = available_seconds(main, used, bonus_enabled)
+        elapsed = rng.randint(0, allowance + 600)
+        new_main, new_used, deducted = deduct(main, used, elapsed, allowance, bonus_enabled)
+        for column, value in zip(columns, (main, used, elapsed, allowance, bonus_enabled)):
+            column.append(value)
+
+        # Nothing is created or lost: the log entry matches the change in the balance
+        assert deducted == min(elapsed, allowance)
+        assert deducted == (main - new_main) + (new_used - used)
+        assert new_main >= MIN_BALANCE_SECONDS and 0 <= new_used <= DAILY_BONUS_SECONDS
+        assert to_seconds(to_minutes(new_main)) == new_main
+
+        # Same result as the old code, up to its rounding to a tenth of a minute (6 seconds).
+        # The old code only charged the bonus for the part of an overrun that fit above -5 minutes,
+        # so those sessions are now charged in full instead.
+        legacy_main, legacy_used, legacy_deducted = legacy_deduct(minutes, bonus_used, elapsed, minutes, bonus_enabled)
+        if not (bonus_enabled and main > 0 and deducted > main):
+            assert abs(to_seconds(legacy_main) - new_main) <= 6, (minutes, bonus_used, elapsed, bonus_enabled)
+            assert abs(to_seconds(legacy_used) - new_used) <= 6, (minutes, bonus_used, elapsed, bonus_enabled)
+        assert abs(to_seconds(legacy_deducted) - deducted) <= 3
+
+    # The batch API gives the same rows as deduct()
+    batch = deduct_batch(*columns)
+    assert list(zip(*batch)) == [deduct(*row) for row in zip(*columns)]
+
+
+
+def test_display_minutes():
+    # JSON shows whole minutes as integers, like before balances were kept to the second
+    assert display_minutes(30.0) == 30 and isinstance(display_minutes(30.0), int)
+    assert display_minutes(-5.0) == -5 and isinstance(display_minutes(-5.0), int)
+    assert display_minutes(29.98) == 29.98
+
+
+if __name__ == "__main__":
+    test_deduct_matches_legacy()
+    test_display_minutes()
+    print(f"OK: {SAMPLES} random balances")
@@ -0,0 +1,76 @@
+"""Check that starting, polling and stopping a session stay within their SQL statement counts.
+
+The admin config comes from storage.admin_config_cache, so none of them may read it from the database.
+"""
+import os
+import tempfile
+
+# A throwaway database, set up before main.py creates its engine
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test_query_counts.db"
+os.environ["LOG_ARCHIVE_DAYS"] = "0"
+os.environ["LOCK_BACKEND"] = "none"
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+
+DEVICE = "test-device"
+START_QUERIES = 3  # Read the kid, refresh it after making room, journal the start
+STATUS_QUERIES = 0  # Served from the in-memory session registry
+STOP_QUERIES = 7  # Journal, kid, log entry, usage (2), and the balance for balance_changed (2)
+ROUNDS = 3
+
+
+def count_statements(call):
+    """Run call() and return its response and the SQL statements it ran on main.engine"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(main.engine, "before_cursor_execute", record)
+    try:
+        response = call()
+    finally:
+        event.remove(main.engine, "before_cursor_execute", record)
+    assert response.status_code < 400, response.text
+    return statements
+
+
+def assert_within(label, statements, budget):
+    assert not [statement for statement in statements if "adminconfig" in statement.lower()], \
+        f"{label} read the admin config: {statements}"
+    assert len(statements) <= budget, f"{label} ran {len(statements)} statements (budget {budget}): {statements}"
+
+
+def test_session_endpoints_skip_admin_config():
+    with TestClient(main.app) as client:
+        client.post("/admin/login", data={"password": "admin"})
+        client.post("/admin/time", data={"kid_id": 1, "minutes": 600, "reason": "Query count test"})
+        # Warm the admin config cache, as any earlier request would
+        client.get("/admin")
+
+        def start():
+            return client.post("/admin/start_session_with_time", data={"kid_id": 1, "session_time": 5, "device": DEVICE})
+
+        def status():
+            return client.get("/api/session/status", params={"device": DEVICE})
+
+        def stop():
+            return client.post("/admin/stop_session", data={"device": DEVICE})
+
+        for _ in range(ROUNDS):
+            # Nothing runs on the device, so the start doesn't settle a session first
+            assert_within("start", count_statements(start), START_QUERIES)
+            assert main.app.state.sessions.for_device(DEVICE) is not None
+            assert_within("status", count_statements(status), STATUS_QUERIES)
+            # Each stop settles the session started in this round
+            assert_within("stop", count_statements(stop), STOP_QUERIES)
+            assert main.app.state.sessions.for_device(DEVICE) is None
+
+
+if __name__ == "__main__":
+    test_session_endpoints_skip_admin_config()
+    print("OK")